@@ -0,0 +1,79 @@
+"""
+artifact_cache.py — Pipeline artifacts shared across jobs.
+
+Extracted audio, Whisper transcripts and clip detections are keyed by the
+content hash of their input plus every parameter that shapes the result, so
+the same episode uploaded under another job_id (or re-uploaded) reuses them
+instead of re-running ffmpeg, Whisper and GPT. Job-scoped copies in
+PROCESSING_DIR are hard links where possible.
+Eviction is LRU by mtime, capped at ARTIFACT_CACHE_MAX_MB.
+"""
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+from .config import ARTIFACT_CACHE_DIR, ARTIFACT_CACHE_MAX_MB
+from .file_cache import link, evict_lru
+
+_lock = threading.Lock()
+
+
+def key(stage: str, content_hash: str | None, **params) -> str | None:
+    """Cache key for `stage` over content `content_hash`; None if the hash is unknown."""
+    if not content_hash:
+        return None
+    blob = json.dumps({"stage": stage, "sha256": content_hash, **params}, sort_keys=True)
+    return hashlib.sha256(blob.encode()).hexdigest()[:32]
+
+
+def _entry(key: str, suffix: str) -> Path:
+    return ARTIFACT_CACHE_DIR / f"{key}{suffix}"
+
+
+def restore(key: str | None, out: Path) -> bool:
+    """If `key` is cached, place it at `out` and mark it recently used."""
+    if not key:
+        return False
+    entry = _entry(key, out.suffix)
+    with _lock:
+        if not entry.exists():
+            return False
+        os.utime(entry)
+        link(entry, out)
+    return True
+
+
+def store(key: str | None, artifact: Path):
+    """Add a finished artifact to the cache, then evict down to the size cap."""
+    if not key or not artifact.exists():
+        return
+    with _lock:
+        link(artifact, _entry(key, artifact.suffix))
+        evict_lru(ARTIFACT_CACHE_DIR, ARTIFACT_CACHE_MAX_MB, pattern="*.*")
+
+
+def load_json(key: str | None):
+    if not key:
+        return None
+    entry = _entry(key, ".json")
+    with _lock:
+        try:
+            data = json.loads(entry.read_text())
+        except (OSError, ValueError):
+            return None
+        os.utime(entry)
+    return data
+
+
+def save_json(key: str | None, data):
+    if not key:
+        return
+    ARTIFACT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    entry = _entry(key, ".json")
+    tmp = entry.with_name(entry.name + ".part")
+    with _lock:
+        tmp.write_text(json.dumps(data))
+        os.replace(tmp, entry)
+        evict_lru(ARTIFACT_CACHE_DIR, ARTIFACT_CACHE_MAX_MB, pattern="*.*")
@@ -1,6 +1,7 @@
 import json
 from pathlib import Path
 from .config import PROCESSING_DIR, MARKETING_CLIPS_DIR, REELS_OUTPUT_DIR
+from . import media_index
 
 SOURCE_MAP = {
     "The Office Best Scenes_visual_analysis": {
@@ -58,10 +59,17 @@ def _load_from_disk() -> list[dict]:
         slug = meta["slug"]
         source_file = str(MARKETING_CLIPS_DIR / meta["file"])
         raw_clips = data.get("top_clips") or data.get("clips") or []
+        # Real duration from the media index (None if the source is missing)
+        source_duration = media_index.duration(source_file)
 
         for c in raw_clips:
             score = c.get("meme_score", 0)
             start = c.get("start_seconds", 0)
+            duration = c.get("duration_seconds", 10)
+            if source_duration is not None:
+                if start >= source_duration:
+                    continue  # analysis points past the end of the file
+                duration = min(duration, round(source_duration - start, 2))
             clip_id = f"{slug}_{start}"
             is_rendered = any(clip_id in s for s in rendered)
             clips.append({
@@ -72,7 +80,8 @@ def _load_from_disk() -> list[dict]:
                 "rank":                 c.get("rank"),
                 "timestamp":            c.get("timestamp", ""),
                 "start_seconds":        start,
-                "duration_seconds":     c.get("duration_seconds", 10),
+                "duration_seconds":     duration,
+                "source_duration":      source_duration,
                 "what_happens_visually": c.get("what_happens_visually", ""),
                 "dialogue_hook":        c.get("dialogue_hook", ""),
                 "meme_caption":         c.get("meme_caption", ""),
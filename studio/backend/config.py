@@ -20,6 +20,14 @@ TMP_DIR             = BASE_DIR / "studio" / "tmp"
 REVIEW_DIR          = BASE_DIR / "studio" / "review"
 INBOX_DIR           = BASE_DIR / "studio" / "inbox"
 QUEUE_FILE          = BASE_DIR / "studio" / "queue.json"
+QUEUE_DB            = BASE_DIR / "studio" / "queue.db"
+RENDER_CACHE_DIR    = BASE_DIR / "studio" / "cache" / "renders"
+QUEUE_ARCHIVE_DIR   = BASE_DIR / "studio" / "queue_archive"
+MEDIA_INDEX_DIR     = BASE_DIR / "studio" / "cache" / "media"
+OVERLAY_CACHE_DIR   = BASE_DIR / "studio" / "cache" / "overlays"
+BASE_CACHE_DIR      = BASE_DIR / "studio" / "cache" / "bases"
+SEGMENT_CACHE_DIR   = BASE_DIR / "studio" / "cache" / "segments"
+ARTIFACT_CACHE_DIR  = BASE_DIR / "studio" / "cache" / "artifacts"
 # v2 pipeline dirs
 UPLOADS_DIR         = BASE_DIR / "studio" / "uploads"
 LIBRARY_DIR         = BASE_DIR / "studio" / "library"
@@ -29,6 +37,46 @@ CTA_TAGLINE_DEFAULT = "Try CrowdListen now"
 CTA_SUBTITLE        = "the PM for AI Agents"
 CTA_URL             = "crowdlisten.com"
 
+# ── Queue / render tuning (env overridable) ──────────────────────────────────
+QUEUE_BACKEND       = os.getenv("STUDIO_QUEUE_BACKEND", "sqlite")   # sqlite | json
+# Render workers — 0 means derive from CPU count / FFMPEG_THREADS
+RENDER_WORKERS      = int(os.getenv("STUDIO_RENDER_WORKERS", "0"))
+FFMPEG_THREADS      = int(os.getenv("STUDIO_FFMPEG_THREADS", "4"))
+# Composited clip renders: "ffmpeg" (subprocess per render) or "pyav" (in-process)
+RENDER_BACKEND      = os.getenv("STUDIO_RENDER_BACKEND", "ffmpeg")
+# Workers are woken by add_job; this poll only catches jobs written by other processes
+QUEUE_POLL_SECONDS  = float(os.getenv("STUDIO_QUEUE_POLL_SECONDS", "10"))
+# A rendering job whose heartbeat stops for LEASE_SECONDS is requeued
+LEASE_SECONDS           = int(os.getenv("STUDIO_LEASE_SECONDS", "60"))
+LEASE_HEARTBEAT_SECONDS = LEASE_SECONDS / 4
+JOB_MAX_ATTEMPTS        = int(os.getenv("STUDIO_JOB_MAX_ATTEMPTS", "3"))
+# Jobs queued longer than this jump ahead of deadlines/priority
+STARVATION_SECONDS  = int(os.getenv("STUDIO_STARVATION_SECONDS", "1800"))
+RENDER_CACHE_MAX_MB = int(os.getenv("STUDIO_RENDER_CACHE_MB", "4096"))
+# Caption-free 1080x1920 base segments kept for fast caption-only re-renders
+BASE_CACHE_MAX_MB   = int(os.getenv("STUDIO_BASE_CACHE_MB", "8192"))
+# Rendered caption/CTA overlay PNGs (two 1080x1920 layers per caption)
+OVERLAY_CACHE_MAX_MB = int(os.getenv("STUDIO_OVERLAY_CACHE_MB", "512"))
+# Concat-ready normalized clips/ads, keyed by content hash
+SEGMENT_CACHE_MAX_MB = int(os.getenv("STUDIO_SEGMENT_CACHE_MB", "4096"))
+# ffprobe/keyframe/hash facts per source file (see media_index)
+MEDIA_INDEX_MAX_MB  = int(os.getenv("STUDIO_MEDIA_INDEX_MB", "256"))
+# Pipeline audio/transcripts/detections shared across jobs, keyed by content hash
+ARTIFACT_CACHE_MAX_MB = int(os.getenv("STUDIO_ARTIFACT_CACHE_MB", "2048"))
+# Chunked encoding of long segments: split at the first keyframe after every
+# CHUNK_SECONDS (0 disables) and encode chunks on idle render slots (0 = up to all)
+CHUNK_SECONDS       = float(os.getenv("STUDIO_CHUNK_SECONDS", "20"))
+CHUNK_WORKERS       = int(os.getenv("STUDIO_CHUNK_WORKERS", "0"))
+# Long uploads are transcribed in windows of this many seconds so detection of
+# early windows can start while later ones are still being transcribed
+TRANSCRIBE_WINDOW_SECONDS = float(os.getenv("STUDIO_TRANSCRIBE_WINDOW", "600"))
+# Concurrent LLM detection calls per pipeline
+DETECT_WORKERS      = int(os.getenv("STUDIO_DETECT_WORKERS", "4"))
+# Finished jobs older than this move from the hot queue to queue_archive/
+QUEUE_ARCHIVE_AFTER_DAYS = float(os.getenv("STUDIO_QUEUE_ARCHIVE_DAYS", "7"))
+# Minimum gap between ffmpeg progress events per render
+PROGRESS_INTERVAL_SECONDS = float(os.getenv("STUDIO_PROGRESS_INTERVAL", "1.0"))
+
 # Ensure runtime dirs exist
 for d in [TMP_DIR, REVIEW_DIR, INBOX_DIR, PUBLISHED_DIR, UPLOADS_DIR, LIBRARY_DIR, ADS_DIR]:
     d.mkdir(parents=True, exist_ok=True)
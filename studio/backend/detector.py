@@ -1,12 +1,16 @@
 """
 detector.py — LLM-based clip candidate detection (meme + quote)
 """
+import hashlib
 import json
 from pathlib import Path
 
 import httpx
 
 from .config import PROCESSING_DIR, OPENAI_API_KEY
+from . import artifact_cache, metrics
+
+GPT_MODEL = "gpt-4o"
 
 AUDIENCE_DEFAULT = "engineers, PMs, founders, and the broader AI / startup community"
 
@@ -69,17 +73,18 @@ def _build_transcript_text(transcript: dict) -> str:
 def _call_gpt(prompt: str) -> dict:
     if not OPENAI_API_KEY:
         raise RuntimeError("OPENAI_API_KEY not set")
-    response = httpx.post(
-        "https://api.openai.com/v1/chat/completions",
-        headers={"Authorization": f"Bearer {OPENAI_API_KEY}"},
-        json={
-            "model": "gpt-4o",
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.4,
-            "max_tokens": 4096,
-        },
-        timeout=60,
-    )
+    with metrics.api("gpt"):
+        response = httpx.post(
+            "https://api.openai.com/v1/chat/completions",
+            headers={"Authorization": f"Bearer {OPENAI_API_KEY}"},
+            json={
+                "model": GPT_MODEL,
+                "messages": [{"role": "user", "content": prompt}],
+                "temperature": 0.4,
+                "max_tokens": 4096,
+            },
+            timeout=60,
+        )
     response.raise_for_status()
     raw = response.json()["choices"][0]["message"]["content"].strip()
     # Strip markdown fences if present
@@ -90,6 +95,30 @@ def _call_gpt(prompt: str) -> dict:
     return json.loads(raw)
 
 
+PROMPTS = {"meme": MEME_PROMPT, "quote": QUOTE_PROMPT}
+
+
+def detect_type(transcript: dict, clip_type: str, count: int,
+                audience: str = AUDIENCE_DEFAULT) -> list[dict]:
+    """
+    One LLM call: up to `count` candidates of `clip_type` ("meme" | "quote").
+    Results are shared across jobs, keyed by the prompt's content hash.
+    """
+    prompt = PROMPTS[clip_type].format(
+        audience=audience, count=count,
+        transcript=_build_transcript_text(transcript)[:12000]
+    )
+    key = artifact_cache.key("detect", hashlib.sha256(prompt.encode()).hexdigest(),
+                             model=GPT_MODEL, clip_type=clip_type)
+    clips = artifact_cache.load_json(key)
+    if clips is None:
+        clips = _call_gpt(prompt).get("clips", [])
+        for c in clips:
+            c["type"] = clip_type
+        artifact_cache.save_json(key, clips)
+    return clips
+
+
 def detect_clips(
     transcript: dict,
     job_id: str,
@@ -102,31 +131,25 @@ def detect_clips(
     if clips_path.exists():
         return json.loads(clips_path.read_text())
 
-    transcript_text = _build_transcript_text(transcript)
     all_clips = []
-
-    if "meme" in clip_types:
-        prompt = MEME_PROMPT.format(
-            audience=audience, count=count,
-            transcript=transcript_text[:12000]
-        )
-        data = _call_gpt(prompt)
-        for c in data.get("clips", []):
-            c["type"] = "meme"
-            all_clips.append(c)
-
-    if "quote" in clip_types:
-        prompt = QUOTE_PROMPT.format(
-            audience=audience, count=count,
-            transcript=transcript_text[:12000]
-        )
-        data = _call_gpt(prompt)
-        for c in data.get("clips", []):
-            c["type"] = "quote"
-            all_clips.append(c)
+    for clip_type in ("meme", "quote"):
+        if clip_type in clip_types:
+            all_clips.extend(detect_type(transcript, clip_type, count, audience))
 
     # Sort by score desc
     all_clips.sort(key=lambda x: x.get("score", 0), reverse=True)
 
-    clips_path.write_text(json.dumps(all_clips, indent=2))
+    save_clips(job_id, all_clips)
     return all_clips
+
+
+def save_clips(job_id: str, clips: list[dict]):
+    """Cache candidates as <job_id>_clips.json, in the given order."""
+    (PROCESSING_DIR / f"{job_id}_clips.json").write_text(json.dumps(clips, indent=2))
+
+
+def load_cached_clips(job_id: str) -> list[dict] | None:
+    clips_path = PROCESSING_DIR / f"{job_id}_clips.json"
+    if clips_path.exists():
+        return json.loads(clips_path.read_text())
+    return None
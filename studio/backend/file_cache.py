@@ -0,0 +1,42 @@
+"""
+file_cache.py — Helpers shared by the on-disk caches.
+
+Entries are placed with link() (a hard link where the filesystem allows, a copy
+otherwise) and renamed into place, so readers never see a partial file.
+evict_lru() trims a cache directory to a size cap, oldest mtime first; caches
+touch an entry's mtime on every hit to keep it recently used.
+"""
+import os
+import shutil
+from pathlib import Path
+
+
+def link(src: Path, dst: Path):
+    """Place `src` at `dst` atomically, as a hard link where possible."""
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(dst.name + ".part")
+    tmp.unlink(missing_ok=True)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+
+
+def evict_lru(directory: Path, max_mb: int, pattern: str = "*.mp4"):
+    """Delete least-recently-used (oldest mtime) files until under `max_mb`."""
+    entries = []
+    for p in directory.glob(pattern):
+        try:
+            st = p.stat()
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, p))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    limit = max_mb * 1024 * 1024
+    for _, size, p in entries:
+        if total <= limit:
+            break
+        total -= size
+        p.unlink(missing_ok=True)
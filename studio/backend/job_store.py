@@ -0,0 +1,304 @@
+"""
+job_store.py — Pluggable persistence for the render queue.
+
+JsonJobStore keeps the original whole-file queue.json behaviour.
+SqliteJobStore keeps one row per job with indexed status/created_at columns,
+so a status update touches one row instead of rewriting every job.
+"""
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable
+
+
+class JobStore:
+    """Interface used by queue.py. Jobs are plain dicts keyed by "id"."""
+
+    def all(self) -> list[dict]:
+        raise NotImplementedError
+
+    def by_status(self, status: str) -> list[dict]:
+        return [j for j in self.all() if j.get("status") == status]
+
+    def get(self, job_id: str) -> dict | None:
+        raise NotImplementedError
+
+    def add(self, job: dict) -> dict:
+        raise NotImplementedError
+
+    def add_many(self, jobs: list[dict]) -> list[dict]:
+        """Insert all jobs in one write (all or nothing)."""
+        raise NotImplementedError
+
+    def update(self, job_id: str, updates: dict) -> dict | None:
+        raise NotImplementedError
+
+    def remove(self, job_id: str) -> bool:
+        raise NotImplementedError
+
+    def replace_all(self, jobs: list[dict]):
+        raise NotImplementedError
+
+    def find(self, statuses: tuple[str, ...], created_before: str) -> list[dict]:
+        """Jobs in any of `statuses` created before the given ISO timestamp."""
+        return [j for j in self.all()
+                if j.get("status") in statuses and (j.get("created_at") or "") < created_before]
+
+    def remove_many(self, job_ids: list[str]) -> int:
+        raise NotImplementedError
+
+    def update_where(self, job_id: str, match: dict, updates: dict) -> dict | None:
+        """Compare-and-set: apply `updates` only if every `match` field still holds."""
+        raise NotImplementedError
+
+    def claim_next(self, make_updates: Callable[[dict], dict],
+                   choose: Callable[[list[dict]], dict] | None = None) -> dict | None:
+        """
+        Atomically apply make_updates(job) to the next queued job and return it.
+        `choose` picks from the queued jobs (oldest first); default is FIFO.
+        """
+        raise NotImplementedError
+
+
+def _matches(job: dict, match: dict) -> bool:
+    return all(job.get(k) == v for k, v in match.items())
+
+
+# ── JSON file (legacy) ───────────────────────────────────────────────────────
+
+class JsonJobStore(JobStore):
+    """Whole-file store: every write re-reads and rewrites queue.json."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.RLock()
+
+    def _read(self) -> list[dict]:
+        if not self.path.exists():
+            return []
+        try:
+            return json.loads(self.path.read_text())
+        except Exception:
+            return []
+
+    def _write(self, jobs: list[dict]):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(jobs, indent=2))
+
+    def all(self) -> list[dict]:
+        with self._lock:
+            return self._read()
+
+    def get(self, job_id: str) -> dict | None:
+        return next((j for j in self.all() if j["id"] == job_id), None)
+
+    def add(self, job: dict) -> dict:
+        return self.add_many([job])[0]
+
+    def add_many(self, jobs: list[dict]) -> list[dict]:
+        with self._lock:
+            existing = self._read()
+            existing.extend(jobs)
+            self._write(existing)
+        return jobs
+
+    def update(self, job_id: str, updates: dict) -> dict | None:
+        with self._lock:
+            jobs = self._read()
+            for job in jobs:
+                if job["id"] == job_id:
+                    job.update(updates)
+                    self._write(jobs)
+                    return job
+        return None
+
+    def remove(self, job_id: str) -> bool:
+        with self._lock:
+            jobs = self._read()
+            new_jobs = [j for j in jobs if j["id"] != job_id]
+            if len(new_jobs) == len(jobs):
+                return False
+            self._write(new_jobs)
+        return True
+
+    def replace_all(self, jobs: list[dict]):
+        with self._lock:
+            self._write(jobs)
+
+    def remove_many(self, job_ids: list[str]) -> int:
+        ids = set(job_ids)
+        with self._lock:
+            jobs = self._read()
+            kept = [j for j in jobs if j["id"] not in ids]
+            self._write(kept)
+        return len(jobs) - len(kept)
+
+    def update_where(self, job_id: str, match: dict, updates: dict) -> dict | None:
+        with self._lock:
+            jobs = self._read()
+            for job in jobs:
+                if job["id"] == job_id:
+                    if not _matches(job, match):
+                        return None
+                    job.update(updates)
+                    self._write(jobs)
+                    return job
+        return None
+
+    def claim_next(self, make_updates: Callable[[dict], dict],
+                   choose: Callable[[list[dict]], dict] | None = None) -> dict | None:
+        with self._lock:
+            jobs = self._read()
+            queued = [j for j in jobs if j.get("status") == "queued"]
+            if not queued:
+                return None
+            job = choose(queued) if choose else queued[0]
+            job.update(make_updates(job))
+            self._write(jobs)
+        return job
+
+
+# ── SQLite ───────────────────────────────────────────────────────────────────
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id         TEXT PRIMARY KEY,
+    status     TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    data       TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status  ON jobs(status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs(created_at);
+"""
+
+
+class SqliteJobStore(JobStore):
+    """
+    One row per job. status and created_at are mirrored out of the JSON blob
+    into indexed columns; everything else lives in `data`.
+
+    If `import_from` points at an existing queue.json and the table is empty,
+    its jobs are imported once and the file is renamed to queue.json.imported.
+    """
+
+    def __init__(self, path: Path, import_from: Path | None = None):
+        self.path = path
+        self._lock = threading.RLock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), isolation_level=None,
+                                     check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        if import_from is not None:
+            self._import_json(import_from)
+
+    @contextmanager
+    def _tx(self):
+        """Serialise writers in-process and take the SQLite write lock up front."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _query(self, sql: str, params: tuple = ()) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    @staticmethod
+    def _row(job: dict) -> tuple:
+        return (job["id"], job.get("status", "queued"), job.get("created_at") or "",
+                json.dumps(job))
+
+    def _import_json(self, json_path: Path):
+        if not json_path.exists():
+            return
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()
+        if count:
+            return
+        jobs = JsonJobStore(json_path).all()
+        self.replace_all(jobs)
+        json_path.rename(json_path.with_name(json_path.name + ".imported"))
+
+    def all(self) -> list[dict]:
+        return self._query("SELECT data FROM jobs ORDER BY created_at, rowid")
+
+    def by_status(self, status: str) -> list[dict]:
+        return self._query(
+            "SELECT data FROM jobs WHERE status = ? ORDER BY created_at, rowid", (status,))
+
+    def get(self, job_id: str) -> dict | None:
+        rows = self._query("SELECT data FROM jobs WHERE id = ?", (job_id,))
+        return rows[0] if rows else None
+
+    def add(self, job: dict) -> dict:
+        return self.add_many([job])[0]
+
+    def add_many(self, jobs: list[dict]) -> list[dict]:
+        with self._tx() as conn:
+            conn.executemany("INSERT INTO jobs (id, status, created_at, data) VALUES (?, ?, ?, ?)",
+                             [self._row(j) for j in jobs])
+        return jobs
+
+    def _put(self, conn: sqlite3.Connection, job: dict):
+        conn.execute("UPDATE jobs SET status = ?, created_at = ?, data = ? WHERE id = ?",
+                     self._row(job)[1:] + (job["id"],))
+
+    def update(self, job_id: str, updates: dict) -> dict | None:
+        return self.update_where(job_id, {}, updates)
+
+    def update_where(self, job_id: str, match: dict, updates: dict) -> dict | None:
+        with self._tx() as conn:
+            row = conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if not row:
+                return None
+            job = json.loads(row[0])
+            if not _matches(job, match):
+                return None
+            job.update(updates)
+            self._put(conn, job)
+        return job
+
+    def remove(self, job_id: str) -> bool:
+        with self._tx() as conn:
+            cur = conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        return cur.rowcount > 0
+
+    def find(self, statuses: tuple[str, ...], created_before: str) -> list[dict]:
+        marks = ",".join("?" * len(statuses))
+        return self._query(f"SELECT data FROM jobs WHERE status IN ({marks}) "
+                           "AND created_at < ? ORDER BY created_at, rowid",
+                           (*statuses, created_before))
+
+    def remove_many(self, job_ids: list[str]) -> int:
+        with self._tx() as conn:
+            cur = conn.executemany("DELETE FROM jobs WHERE id = ?", [(i,) for i in job_ids])
+        return cur.rowcount
+
+    def replace_all(self, jobs: list[dict]):
+        with self._tx() as conn:
+            conn.execute("DELETE FROM jobs")
+            conn.executemany("INSERT OR REPLACE INTO jobs (id, status, created_at, data) "
+                             "VALUES (?, ?, ?, ?)", [self._row(j) for j in jobs])
+
+    def claim_next(self, make_updates: Callable[[dict], dict],
+                   choose: Callable[[list[dict]], dict] | None = None) -> dict | None:
+        with self._tx() as conn:
+            sql = "SELECT data FROM jobs WHERE status = 'queued' ORDER BY created_at, rowid"
+            if choose is None:
+                sql += " LIMIT 1"
+            queued = [json.loads(r[0]) for r in conn.execute(sql).fetchall()]
+            if not queued:
+                return None
+            job = choose(queued) if choose else queued[0]
+            job.update(make_updates(job))
+            self._put(conn, job)
+        return job
@@ -1,3 +1,4 @@
+import hashlib
 import shutil
 import uuid
 from datetime import datetime, timezone, date
@@ -15,11 +16,14 @@ from .config import (PUBLISHED_DIR, TMP_DIR, REVIEW_DIR, INBOX_DIR,
                      UPLOADS_DIR, LIBRARY_DIR, ADS_DIR, PROCESSING_DIR)
 from . import clips as clip_lib
 from . import queue as q
+from . import queue_archive
 from . import sse as sse_bus
 from .search import smart_search
 from . import calendar_api as cal
 from . import publish as publish_lib
 from . import pipeline as pipeline_lib
+from .renderer import PROFILES, QUEUE_MODES, seek_args
+from . import media_index
 
 app = FastAPI(title="CrowdListen Studio")
 
@@ -35,6 +39,7 @@ app.add_middleware(
 def on_startup():
     from .queue import start_processor
     start_processor()
+    pipeline_lib.resume_interrupted()
 
 
 # ── SSE ──────────────────────────────────────────────────────────────────────
@@ -95,32 +100,73 @@ def smart_search_endpoint(body: dict):
 def batch_render(jobs: list[dict]):
     """
     Queue multiple render jobs at once.
-    Each job: {clip_id, caption, mode, output_name, [body_script, voice]}
-    Returns list of job ids.
+    Each job: {clip_id, caption, mode, output_name,
+               [body_script, voice, priority, deadline, variants, profile]}
+    `variants` ([{caption, output_name?}]) renders several captions from one decode.
+    Every spec is validated first; the valid ones are enqueued in one transaction.
+    Returns per-item results in request order.
     """
-    from . import queue as q_lib
+    clip_index = {c["clip_id"]: c for c in clip_lib.load_clips()}
     results = []
+    to_queue = []
     for job_spec in jobs:
         clip_id = job_spec.get("clip_id")
-        clip = clip_lib.get_clip(clip_id)
+        clip = clip_index.get(clip_id) if isinstance(clip_id, str) else None
         if not clip:
             results.append({"clip_id": clip_id, "error": "clip not found"})
             continue
-        job = {
-            "mode":          job_spec.get("mode", "meme"),
-            "output_name":   job_spec.get("output_name") or clip_id,
-            "source_file":   clip["source_file"],
-            "start_sec":     clip["start_seconds"],
-            "duration_sec":  clip["duration_seconds"],
-            "hook_caption":  job_spec.get("caption") or clip["meme_caption"],
-            "hook_clip_id":  clip_id,
-        }
-        if job["mode"] == "narration":
-            job["body_script"] = job_spec.get("body_script", "")
-            job["voice"]       = job_spec.get("voice", "shimmer")
-        job_id = q_lib.enqueue(job)
-        results.append({"clip_id": clip_id, "job_id": job_id, "output_name": job["output_name"]})
-    return {"queued": len([r for r in results if "job_id" in r]), "results": results}
+        try:
+            deadline = q.normalize_deadline(job_spec.get("deadline"))
+        except ValueError:
+            results.append({"clip_id": clip_id, "error": f"invalid deadline: {job_spec['deadline']}"})
+            continue
+        profile = job_spec.get("profile") or "draft"
+        if not isinstance(profile, str) or profile not in PROFILES:
+            results.append({"clip_id": clip_id, "error": f"unknown profile: {profile}"})
+            continue
+        try:
+            priority = int(job_spec.get("priority") or 0)
+        except (TypeError, ValueError):
+            results.append({"clip_id": clip_id, "error": f"invalid priority: {job_spec['priority']}"})
+            continue
+        mode = job_spec.get("mode", "meme")
+        if mode not in QUEUE_MODES:
+            results.append({"clip_id": clip_id, "error": f"render mode not supported: {mode}"})
+            continue
+        variants = job_spec.get("variants")
+        if variants and mode != "meme":
+            results.append({"clip_id": clip_id,
+                            "error": "variants are only supported for meme renders"})
+            continue
+        if variants is not None and not (isinstance(variants, list)
+                                         and all(isinstance(v, dict) for v in variants)):
+            results.append({"clip_id": clip_id,
+                            "error": "variants must be a list of {caption, output_name?}"})
+            continue
+        job = q.build_job(
+            mode=mode,
+            hook_clip_id=clip_id,
+            hook_caption=job_spec.get("caption") or clip["meme_caption"],
+            body_script=job_spec.get("body_script", "") if mode == "narration" else "",
+            body_audio_file=None,
+            voice=job_spec.get("voice", "shimmer"),
+            provider=job_spec.get("provider", "openai"),
+            cta_tagline=CTA_TAGLINE_DEFAULT,
+            cta_subtitle=CTA_SUBTITLE,
+            cta_url=CTA_URL,
+            output_name=job_spec.get("output_name") or clip_id,
+            source_file=clip["source_file"],
+            start_sec=clip["start_seconds"],
+            duration_sec=clip["duration_seconds"],
+            priority=priority,
+            deadline=deadline,
+            variants=variants,
+            profile=profile,
+        )
+        to_queue.append(job)
+        results.append({"clip_id": clip_id, "job_id": job["id"], "output_name": job["output_name"]})
+    q.add_jobs(to_queue)
+    return {"queued": len(to_queue), "results": results}
 
 
 @app.get("/api/clips/{clip_id}")
@@ -148,11 +194,17 @@ def clip_preview(clip_id: str):
         clip = clip_lib.get_clip(clip_id)
         if not clip:
             raise HTTPException(404, "Clip not found")
+        rng = media_index.clamp_range(clip["source_file"], clip["start_seconds"],
+                                      clip["duration_seconds"])
+        if rng is None:
+            raise HTTPException(422, "Clip starts past the end of its source")
+        seek_in, seek_out = seek_args(Path(clip["source_file"]), rng[0])
         r = subprocess.run([
             "ffmpeg", "-y",
-            "-ss", str(clip["start_seconds"]),
+            *seek_in,
             "-i", clip["source_file"],
-            "-t", str(clip["duration_seconds"]),
+            *seek_out,
+            "-t", str(rng[1]),
             "-vf", "scale=540:-2",   # half-res for fast preview
             "-c:v", "libx264", "-crf", "28", "-preset", "ultrafast",
             "-c:a", "aac", "-b:a", "64k",
@@ -222,7 +274,7 @@ def content_gen_endpoint(req: ContentGenRequest):
 # ── Render ────────────────────────────────────────────────────────────────────
 
 class RenderRequest(BaseModel):
-    mode: str = "narration"        # meme | narration | cta_only
+    mode: str = "narration"        # meme | narration | cta_only (only meme renders; see QUEUE_MODES)
     # Hook (meme + narration)
     hook_clip_id: str | None = None
     hook_caption: str = ""
@@ -237,6 +289,13 @@ class RenderRequest(BaseModel):
     cta_url: str = CTA_URL
     # Output
     output_name: str = ""
+    # Scheduling
+    priority: int = 0                  # higher renders first
+    deadline: str | None = None        # YYYY-MM-DD or ISO timestamp
+    # Caption A/B test (meme only): [{caption, output_name?}], one decode for all
+    variants: list[dict] | None = None
+    # Encode profile: draft (review, default) | final | archive
+    profile: str = "draft"
 
 
 @app.post("/api/render", status_code=202)
@@ -246,6 +305,10 @@ def submit_render(req: RenderRequest):
     start_sec = 0
     duration_sec = 10
 
+    if req.mode not in QUEUE_MODES:
+        raise HTTPException(400, f"Render mode not supported: {req.mode} "
+                                 f"(supported: {', '.join(QUEUE_MODES)})")
+
     if req.mode != "cta_only":
         if not req.hook_clip_id:
             raise HTTPException(400, "hook_clip_id required for this mode")
@@ -256,6 +319,15 @@ def submit_render(req: RenderRequest):
         start_sec = clip["start_seconds"]
         duration_sec = clip["duration_seconds"]
 
+    try:
+        deadline = q.normalize_deadline(req.deadline)
+    except ValueError:
+        raise HTTPException(400, f"Invalid deadline: {req.deadline}")
+    if req.variants and req.mode != "meme":
+        raise HTTPException(400, "variants are only supported for meme renders")
+    if req.profile not in PROFILES:
+        raise HTTPException(400, f"Unknown profile: {req.profile}")
+
     job = q.build_job(
         mode=req.mode,
         hook_clip_id=req.hook_clip_id or "",
@@ -271,6 +343,10 @@ def submit_render(req: RenderRequest):
         source_file=source_file,
         start_sec=start_sec,
         duration_sec=duration_sec,
+        priority=req.priority,
+        deadline=deadline,
+        variants=req.variants,
+        profile=req.profile,
     )
     q.add_job(job)
     return job
@@ -283,9 +359,24 @@ def get_queue():
     return list(reversed(q.load_queue()))
 
 
+@app.get("/api/queue/workers")
+def queue_workers():
+    """What each render worker is doing right now."""
+    return q.worker_status()
+
+
+@app.get("/api/queue/history")
+def queue_history(offset: int = 0, limit: int = 50, status: str | None = None):
+    """Archived (finished) jobs, newest first."""
+    # limit < 1 would never fill a page, so history() would read the whole archive
+    return queue_archive.history(offset=max(offset, 0), limit=min(max(limit, 1), 500),
+                                 status=status)
+
+
 @app.delete("/api/queue/{job_id}")
 def delete_job(job_id: str):
-    if not q.remove_job(job_id):
+    """Remove a job, killing its ffmpeg process if it's already rendering."""
+    if not q.cancel_job(job_id):
         raise HTTPException(404, "Job not found")
     return {"ok": True}
 
@@ -320,13 +411,20 @@ def approve_video(filename: str):
     src = REVIEW_DIR / filename
     if not src.exists():
         raise HTTPException(404, "Video not found")
+    job = q.job_for_output(filename)
+    if not job:
+        # Without the job there's no telling a draft from a final; publishing
+        # blind could ship a draft-quality encode
+        raise HTTPException(409, "No render job found for this video")
+    if job.get("profile") not in (None, "final", "archive"):
+        # Draft approved: re-render at final quality in the background; the
+        # worker writes the result to published/ and removes the draft.
+        # A failed final releases the draft, so approving again retries it.
+        final = q.pending_final(job, filename) or q.promote_to_final(job, filename)
+        return {"ok": True, "final_job_id": final["id"], "finalizing": True}
     dst = PUBLISHED_DIR / filename
     shutil.move(str(src), str(dst))
-    # Update job status
-    for job in q.load_queue():
-        if job.get("output_name") and filename.startswith(job["output_name"]):
-            q.update_job(job["id"], {"status": "published"})
-            break
+    q.update_job(job["id"], {"status": "published"})
     return {"ok": True, "published": f"/api/published/{filename}"}
 
 
@@ -336,6 +434,9 @@ def reject_video(filename: str):
     if not path.exists():
         raise HTTPException(404, "Video not found")
     path.unlink()
+    job = q.job_for_output(filename)
+    if job and job["status"] == "review":
+        q.reject_output(job, filename)
     return {"ok": True}
 
 
@@ -550,6 +651,12 @@ def queue_calendar_render(entry_id: str):
     if not clip:
         raise HTTPException(404, f"Clip not found: {entry['clip_id']}")
 
+    # Calendar date doubles as the render deadline
+    try:
+        deadline = q.normalize_deadline(entry.get("date"))
+    except ValueError:
+        deadline = None
+
     # Build and queue the job
     job = q.build_job(
         mode="meme",
@@ -566,6 +673,7 @@ def queue_calendar_render(entry_id: str):
         source_file=clip["source_file"],
         start_sec=clip["start_seconds"],
         duration_sec=clip["duration_seconds"],
+        deadline=deadline,
     )
     q.add_job(job)
 
@@ -584,10 +692,16 @@ async def upload_video(file: UploadFile = File(...)):
     job_dir = UPLOADS_DIR / job_id
     job_dir.mkdir(parents=True, exist_ok=True)
     dest = job_dir / file.filename
+    # Hash while streaming to disk so the pipeline's content-keyed caches
+    # never have to read the upload a second time
+    digest = hashlib.sha256()
     with open(dest, "wb") as f:
-        content = await file.read()
-        f.write(content)
-    return {"job_id": job_id, "filename": file.filename, "path": str(dest)}
+        while chunk := await file.read(1 << 20):
+            digest.update(chunk)
+            f.write(chunk)
+    media_index.remember(dest, "sha256", digest.hexdigest())
+    return {"job_id": job_id, "filename": file.filename, "path": str(dest),
+            "sha256": digest.hexdigest()}
 
 
 class AdConfig(BaseModel):
@@ -613,11 +727,9 @@ def start_pipeline(req: PipelineRequest):
     job_dir = UPLOADS_DIR / req.job_id
     if not job_dir.exists():
         raise HTTPException(404, "Job not found. Upload a video first.")
-    videos = list(job_dir.glob("*.mp4")) + list(job_dir.glob("*.mov")) + \
-             list(job_dir.glob("*.avi")) + list(job_dir.glob("*.mkv"))
-    if not videos:
+    video_path = pipeline_lib.find_upload(req.job_id)
+    if not video_path:
         raise HTTPException(400, "No video found for this job_id")
-    video_path = videos[0]
 
     ad_cfg = req.ad_config.dict() if req.ad_config else None
     if ad_cfg and ad_cfg.get("asset"):
@@ -635,6 +747,12 @@ def start_pipeline(req: PipelineRequest):
     return {"ok": True, "job_id": req.job_id, "status": "started"}
 
 
+@app.get("/api/pipeline/stats")
+def pipeline_stats():
+    """Per-stage wall/CPU/memory/I-O and API latency, aggregated across pipeline runs."""
+    return pipeline_lib.stats()
+
+
 @app.get("/api/pipeline/{job_id}/status")
 def pipeline_status(job_id: str):
     state = pipeline_lib.load_state(job_id)
@@ -643,6 +761,34 @@ def pipeline_status(job_id: str):
     return state
 
 
+@app.post("/api/pipeline/{job_id}/resume")
+def pipeline_resume(job_id: str):
+    """
+    Pick an interrupted, failed or cancelled pipeline back up: finished steps
+    are skipped and only clips with a missing or damaged output re-render.
+    """
+    state = pipeline_lib.load_state(job_id)
+    if not state:
+        raise HTTPException(404, "Job not found")
+    if pipeline_lib.is_running(job_id):
+        raise HTTPException(409, "Pipeline is already running")
+    video_path = Path(state["video_path"]) if state.get("video_path") else None
+    if not video_path or not video_path.exists():
+        video_path = pipeline_lib.find_upload(job_id)
+    if not video_path:
+        raise HTTPException(400, "No video found for this job_id")
+    pipeline_lib.resume_pipeline(job_id, video_path)
+    return {"ok": True, "job_id": job_id, "status": "resumed"}
+
+
+@app.post("/api/pipeline/{job_id}/cancel")
+def pipeline_cancel(job_id: str):
+    """Stop a running pipeline, killing any in-flight clip render."""
+    if not pipeline_lib.cancel_pipeline(job_id):
+        raise HTTPException(404, "No running pipeline for this job")
+    return {"ok": True, "job_id": job_id, "status": "cancelled"}
+
+
 @app.get("/api/library/{job_id}")
 def library_list(job_id: str):
     lib_dir = LIBRARY_DIR / job_id
@@ -0,0 +1,257 @@
+"""
+media_index.py — Persistent per-source media facts.
+
+Each source file gets one JSON entry under MEDIA_INDEX_DIR, keyed by its
+absolute path and invalidated whenever its size or mtime changes. An entry
+holds ffprobe stream metadata (duration, resolution, frame rate, codecs), the
+video keyframe timestamps used for fast seeking and the file's content hash.
+Every field is probed lazily on first lookup and reused until the file changes.
+Entries are evicted LRU by mtime past MEDIA_INDEX_MAX_MB (at most every
+EVICT_EVERY saves), and at most MEM_ENTRIES stay in memory. Transient files
+(e.g. TTS temp audio) can be probed with persist=False to skip the index.
+"""
+import bisect
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from .config import MEDIA_INDEX_DIR, MEDIA_INDEX_MAX_MB
+from . import file_cache
+from . import metrics
+
+MEM_ENTRIES = 1024
+EVICT_EVERY = 100
+
+_lock = threading.Lock()
+_mem: OrderedDict[str, dict] = OrderedDict()
+# Per-source probe lock and how many callers hold or wait on it; dropped at zero
+_probe_locks: dict[str, list] = {}
+_saves = 0
+
+
+def _key(source: str | Path) -> str:
+    return str(Path(source).resolve())
+
+
+def _signature(source: str | Path) -> dict | None:
+    try:
+        st = os.stat(source)
+    except OSError:
+        return None
+    return {"size": st.st_size, "mtime": st.st_mtime}
+
+
+def identity(source: str | Path) -> dict:
+    """Path + size + mtime — changes whenever the file is replaced or edited."""
+    return {"path": _key(source), **(_signature(source) or {})}
+
+
+def _entry_path(key: str) -> Path:
+    return MEDIA_INDEX_DIR / f"{hashlib.sha1(key.encode()).hexdigest()}.json"
+
+
+def _remember(key: str, entry: dict):
+    _mem[key] = entry
+    _mem.move_to_end(key)
+    while len(_mem) > MEM_ENTRIES:
+        _mem.popitem(last=False)
+
+
+def _load(key: str, sig: dict) -> dict | None:
+    entry = _mem.get(key)
+    if entry is None:
+        path = _entry_path(key)
+        try:
+            entry = json.loads(path.read_text())
+            os.utime(path)  # LRU touch
+        except Exception:
+            return None
+    if entry.get("size") != sig["size"] or entry.get("mtime") != sig["mtime"]:
+        return None
+    _remember(key, entry)
+    return entry
+
+
+def _save(key: str, entry: dict):
+    global _saves
+    MEDIA_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    path = _entry_path(key)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(entry))
+    os.replace(tmp, path)
+    _remember(key, entry)
+    _saves += 1
+    if _saves % EVICT_EVERY == 0:
+        file_cache.evict_lru(MEDIA_INDEX_DIR, MEDIA_INDEX_MAX_MB, pattern="*.json")
+
+
+def _probe_keyframes(source: str | Path) -> list[float]:
+    """Keyframe pts from packet flags — demux only, no decoding."""
+    r = metrics.run([
+        "ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", str(source),
+    ])
+    if r.returncode != 0:
+        raise RuntimeError(f"Keyframe probe failed: {r.stderr[-300:]}")
+    times = []
+    for line in r.stdout.splitlines():
+        pts, _, flags = line.partition(",")
+        if "K" in flags and pts not in ("", "N/A"):
+            times.append(float(pts))
+    return sorted(times)
+
+
+def hash_file(source: str | Path) -> str:
+    """sha256 of the file bytes, read now (content_hash is the indexed lookup)."""
+    h = hashlib.sha256()
+    with open(source, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _fps(rate: str | None) -> float | None:
+    num, _, den = (rate or "").partition("/")
+    try:
+        return round(float(num) / float(den or 1), 3) if float(num) else None
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def _probe_streams(source: str | Path) -> dict:
+    """Container duration plus the first video and audio stream's metadata."""
+    r = metrics.run([
+        "ffprobe", "-v", "error", "-print_format", "json",
+        "-show_format", "-show_streams", str(source),
+    ])
+    if r.returncode != 0:
+        raise RuntimeError(f"Stream probe failed: {r.stderr[-300:]}")
+    data = json.loads(r.stdout)
+    fmt = data.get("format", {})
+    streams = data.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), None)
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+    durations = [float(d) for d in [fmt.get("duration")] + [s.get("duration") for s in streams]
+                 if d not in (None, "N/A")]
+    return {
+        "duration": durations[0] if durations else None,
+        "format": fmt.get("format_name"),
+        "bit_rate": int(fmt["bit_rate"]) if fmt.get("bit_rate", "N/A") != "N/A" else None,
+        "video": {
+            "codec": video.get("codec_name"),
+            "width": video.get("width"),
+            "height": video.get("height"),
+            "fps": _fps(video.get("avg_frame_rate")) or _fps(video.get("r_frame_rate")),
+            "pix_fmt": video.get("pix_fmt"),
+        } if video else None,
+        "audio": {
+            "codec": audio.get("codec_name"),
+            "sample_rate": int(audio.get("sample_rate") or 0) or None,
+            "channels": audio.get("channels"),
+        } if audio else None,
+    }
+
+
+def get_entry(source: str | Path, field: str, build, persist: bool = True) -> object | None:
+    """
+    Return `field` from the source's entry, computing it with build(source)
+    on a miss. Returns None if the source doesn't exist or build() fails.
+    With persist=False nothing is read from or written to the index.
+    """
+    key = _key(source)
+    sig = _signature(source)
+    if sig is None:
+        return None
+    if not persist:
+        try:
+            return build(source)
+        except Exception:
+            return None
+    with _lock:
+        entry = _load(key, sig)
+        if entry and field in entry:
+            return entry[field]
+        probe_lock = _probe_locks.setdefault(key, [threading.Lock(), 0])
+        probe_lock[1] += 1
+    # One probe per source at a time; other callers wait for its result
+    try:
+        with probe_lock[0]:
+            with _lock:
+                entry = _load(key, sig)
+                if entry and field in entry:
+                    return entry[field]
+            try:
+                value = build(source)
+            except Exception:
+                return None
+            with _lock:
+                entry = dict(_load(key, sig) or {"path": key, **sig})
+                entry[field] = value
+                _save(key, entry)
+            return value
+    finally:
+        with _lock:
+            probe_lock[1] -= 1
+            if not probe_lock[1]:
+                del _probe_locks[key]
+
+
+def remember(source: str | Path, field: str, value):
+    """Store a field computed elsewhere (e.g. a hash taken while the file was written)."""
+    key = _key(source)
+    sig = _signature(source)
+    if sig is None:
+        return
+    with _lock:
+        entry = dict(_load(key, sig) or {"path": key, **sig})
+        entry[field] = value
+        _save(key, entry)
+
+
+def keyframes(source: str | Path) -> list[float] | None:
+    return get_entry(source, "keyframes", _probe_keyframes)
+
+
+def keyframe_before(source: str | Path, t: float) -> float | None:
+    """Latest keyframe at or before `t`, or None if the index is unavailable."""
+    kfs = keyframes(source)
+    if not kfs:
+        return None
+    i = bisect.bisect_right(kfs, t + 1e-6)
+    return kfs[i - 1] if i else 0.0
+
+
+def content_hash(source: str | Path) -> str | None:
+    """sha256 of the file bytes — same for copies of a file under any name."""
+    return get_entry(source, "sha256", hash_file)
+
+
+def probe(source: str | Path, persist: bool = True) -> dict | None:
+    """Stream metadata (see _probe_streams), or None if the file can't be probed."""
+    return get_entry(source, "probe", _probe_streams, persist)
+
+
+def duration(source: str | Path, persist: bool = True) -> float | None:
+    info = probe(source, persist)
+    return info["duration"] if info else None
+
+
+def has_audio(source: str | Path) -> bool | None:
+    info = probe(source)
+    return None if info is None else info["audio"] is not None
+
+
+def clamp_range(source: str | Path, start: float, length: float) -> tuple[float, float] | None:
+    """
+    (start, length) trimmed to the source's real duration. Returns the range
+    unchanged if the duration is unknown, None if `start` is past the end.
+    """
+    total = duration(source)
+    if total is None:
+        return start, length
+    if start >= total:
+        return None
+    return start, min(length, total - start)
@@ -0,0 +1,196 @@
+"""
+metrics.py — Wall time, CPU and I/O accounting for pipeline stages and renders.
+
+A Meter is attached to a thread with span() (or measure() for a fresh one).
+While attached, it collects:
+- wall time and the thread's own CPU time and block I/O
+- the CPU time, peak RSS and block I/O of every child process reaped on that
+  thread through reap()/run()
+- the latency of every API call timed with api()
+
+A meter can span several threads, e.g. a stage fanned out over a pool. Its
+wall time is then first start to last end, and CPU/I/O are summed.
+"""
+import os
+import resource
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+_local = threading.local()
+
+_RUSAGE_THREAD = getattr(resource, "RUSAGE_THREAD", None)  # Linux only
+_BLOCK = 512  # ru_inblock / ru_oublock unit
+
+
+def _stack() -> list:
+    stack = getattr(_local, "meters", None)
+    if stack is None:
+        stack = _local.meters = []
+    return stack
+
+
+def _thread_usage() -> tuple[float, int, int]:
+    """(cpu seconds, bytes read, bytes written) for the calling thread."""
+    if _RUSAGE_THREAD is None:
+        return time.thread_time(), 0, 0
+    ru = resource.getrusage(_RUSAGE_THREAD)
+    return ru.ru_utime + ru.ru_stime, ru.ru_inblock * _BLOCK, ru.ru_oublock * _BLOCK
+
+
+class Meter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.start: float | None = None
+        self.end: float | None = None
+        self.cpu = 0.0
+        self.read_bytes = 0
+        self.write_bytes = 0
+        self.children = 0
+        self.child_cpu = 0.0
+        self.child_peak_rss_kb = 0
+        self.api: dict[str, dict] = {}
+
+    @contextmanager
+    def span(self):
+        """Charge the calling thread's work (and its children) to this meter for the block."""
+        stack = _stack()
+        stack.append(self)
+        t0, u0 = time.monotonic(), _thread_usage()
+        try:
+            yield self
+        finally:
+            stack.remove(self)
+            t1, u1 = time.monotonic(), _thread_usage()
+            with self._lock:
+                self.start = t0 if self.start is None else min(self.start, t0)
+                self.end = t1 if self.end is None else max(self.end, t1)
+                self.cpu += u1[0] - u0[0]
+                self.read_bytes += u1[1] - u0[1]
+                self.write_bytes += u1[2] - u0[2]
+
+    def _child(self, ru):
+        with self._lock:
+            self.children += 1
+            self.child_cpu += ru.ru_utime + ru.ru_stime
+            self.child_peak_rss_kb = max(self.child_peak_rss_kb, ru.ru_maxrss)
+            self.read_bytes += ru.ru_inblock * _BLOCK
+            self.write_bytes += ru.ru_oublock * _BLOCK
+
+    def _api(self, name: str, seconds: float):
+        with self._lock:
+            entry = self.api.setdefault(name, {"calls": 0, "total_sec": 0.0, "max_sec": 0.0})
+            entry["calls"] += 1
+            entry["total_sec"] = round(entry["total_sec"] + seconds, 3)
+            entry["max_sec"] = round(max(entry["max_sec"], seconds), 3)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            end = self.end if self.end is not None else time.monotonic()
+            return {
+                "wall_sec": round(end - self.start, 3) if self.start is not None else 0.0,
+                "cpu_sec": round(self.cpu, 3),
+                "child_cpu_sec": round(self.child_cpu, 3),
+                "child_peak_rss_mb": round(self.child_peak_rss_kb / 1024, 1),
+                "children": self.children,
+                "read_bytes": self.read_bytes,
+                "write_bytes": self.write_bytes,
+                "api": {k: dict(v) for k, v in self.api.items()},
+            }
+
+
+@contextmanager
+def measure():
+    """A fresh Meter spanning the block on the calling thread."""
+    meter = Meter()
+    with meter.span():
+        yield meter
+
+
+def current() -> tuple:
+    """The meters attached to the calling thread, for handing to pool threads."""
+    return tuple(_stack())
+
+
+@contextmanager
+def attach(meters: tuple):
+    """Charge children and API calls on this thread to `meters` (from current())."""
+    stack = _stack()
+    stack.extend(meters)
+    try:
+        yield
+    finally:
+        del stack[len(stack) - len(meters):]
+
+
+@contextmanager
+def api(name: str):
+    """Time one external API call and record its latency on the attached meters."""
+    t0 = time.monotonic()
+    try:
+        yield
+    finally:
+        seconds = time.monotonic() - t0
+        for meter in _stack():
+            meter._api(name, seconds)
+
+
+def reap(proc: subprocess.Popen) -> int:
+    """proc.wait(), via wait4 so the child's resource usage is recorded."""
+    try:
+        _, status, ru = os.wait4(proc.pid, 0)
+    except ChildProcessError:  # already reaped elsewhere (e.g. by a cancel)
+        return proc.wait()
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    for meter in _stack():
+        meter._child(ru)
+    return proc.returncode
+
+
+def run(cmd: list[str]) -> subprocess.CompletedProcess:
+    """subprocess.run(cmd, capture_output=True, text=True), with the child metered."""
+    with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=out, stderr=err)
+        code = reap(proc)
+        out.seek(0)
+        err.seek(0)
+        return subprocess.CompletedProcess(cmd, code, out.read().decode(errors="replace"),
+                                           err.read().decode(errors="replace"))
+
+
+def summarize(snapshots: list[dict]) -> dict:
+    """Aggregate snapshot() dicts from many runs: wall time distribution, means of the rest."""
+    if not snapshots:
+        return {"runs": 0}
+    walls = sorted(s.get("wall_sec", 0.0) for s in snapshots)
+    api: dict[str, dict] = {}
+    for s in snapshots:
+        for name, entry in s.get("api", {}).items():
+            agg = api.setdefault(name, {"calls": 0, "total_sec": 0.0, "max_sec": 0.0})
+            agg["calls"] += entry["calls"]
+            agg["total_sec"] += entry["total_sec"]
+            agg["max_sec"] = max(agg["max_sec"], entry["max_sec"])
+    for agg in api.values():
+        agg["mean_sec"] = round(agg.pop("total_sec") / max(agg["calls"], 1), 3)
+
+    out = {
+        "runs": len(snapshots),
+        "wall_sec": {"mean": round(statistics.fmean(walls), 3),
+                     "p50": walls[len(walls) // 2],
+                     "p95": walls[min(len(walls) - 1, int(len(walls) * 0.95))],
+                     "max": walls[-1]},
+    }
+    # Only fields the snapshots carry (a run's "total" is wall time alone)
+    for field in ("cpu_sec", "child_cpu_sec", "read_bytes", "write_bytes"):
+        values = [s[field] for s in snapshots if field in s]
+        if values:
+            out[field] = round(statistics.fmean(values), 3)
+    peaks = [s["child_peak_rss_mb"] for s in snapshots if "child_peak_rss_mb" in s]
+    if peaks:
+        out["child_peak_rss_mb"] = max(peaks)
+    if api:
+        out["api"] = api
+    return out
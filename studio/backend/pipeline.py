@@ -1,19 +1,25 @@
 """
 pipeline.py — End-to-end video processing orchestrator
-Runs: extract audio → whisper → detect clips → render
+Runs: extract audio → whisper → detect clips → render, with transcript
+windows, detection and rendering streaming into each other.
 Emits SSE progress events at each step.
 """
 import json
+import math
 import threading
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
 from pathlib import Path
+from queue import Empty, SimpleQueue
 
-from .config import UPLOADS_DIR, PROCESSING_DIR, LIBRARY_DIR
+from .config import UPLOADS_DIR, PROCESSING_DIR, LIBRARY_DIR, DETECT_WORKERS
 from . import sse as sse_bus
-from .whisper import extract_audio, transcribe
-from .detector import detect_clips
-from .renderer import render_clip
+from .whisper import extract_audio, transcribe_windows, window_count
+from .detector import detect_type, load_cached_clips, save_clips
+from . import media_index, metrics, render_pool
+from .renderer import plan_batch, render_group, tracking, cancel, is_cancelled, RenderCancelled
 
 
 def _emit(job_id: str, step: str, status: str, msg: str = "", progress: int = 0):
@@ -26,6 +32,56 @@ def _emit(job_id: str, step: str, status: str, msg: str = "", progress: int = 0)
     })
 
 
+class _RenderProgress:
+    """
+    Aggregates ffmpeg progress from concurrently rendering groups into one
+    monotonic overall percentage, so SSE consumers see a single sane bar.
+    Groups can be added while others render (total grows as detection lands).
+    """
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.total = 0
+        self.done = 0
+        self._weights = {}
+        self._percent = {}
+        self._last = 0.0
+        self._lock = threading.Lock()
+
+    def add_group(self, group: list[dict]):
+        with self._lock:
+            self._weights[id(group)] = len(group)
+            self._percent[id(group)] = 0.0
+            self.total += len(group)
+
+    def _overall(self) -> float:
+        if not self.total:
+            return 100.0
+        weighted = sum(self._percent[k] * w for k, w in self._weights.items())
+        # Never step backwards, even when a group falls back to clip-by-clip
+        self._last = max(self._last, round(weighted / self.total, 1))
+        return self._last
+
+    def finish_group(self, group: list[dict], clips: int):
+        with self._lock:
+            self._percent[id(group)] = 100.0
+            self.done += clips
+
+    def for_group(self, group: list[dict]):
+        """ffmpeg progress callback for one group."""
+        def on_progress(progress: dict):
+            with self._lock:
+                self._percent[id(group)] = max(self._percent[id(group)],
+                                               progress.get("percent") or 0.0)
+                overall = self._overall()
+                done = self.done
+                total = self.total
+            sse_bus.emit(self.job_id, "progress", {
+                **progress, "percent": overall, "clips_done": done, "of": total,
+                "group_percent": progress.get("percent")})
+        return on_progress
+
+
 def _save_state(job_id: str, state: dict):
     path = PROCESSING_DIR / f"{job_id}_state.json"
     state["updated_at"] = datetime.utcnow().isoformat()
@@ -39,6 +95,87 @@ def load_state(job_id: str) -> dict:
     return {}
 
 
+def _artifact(path: Path) -> dict:
+    """Checksum record for a file the pipeline produced."""
+    return {"path": str(path), "size": path.stat().st_size,
+            "sha256": media_index.hash_file(path)}
+
+
+def _artifact_ok(entry: dict) -> bool:
+    """True if the recorded file is still there, the same size and the same bytes."""
+    path = Path(entry["path"])
+    try:
+        if path.stat().st_size != entry.get("size"):
+            return False  # missing size or truncated
+    except OSError:
+        return False
+    return media_index.hash_file(path) == entry.get("sha256")
+
+
+def _output_ok(entry: dict | None, out: Path) -> bool:
+    return bool(entry) and entry["path"] == str(out) and _artifact_ok(entry)
+
+
+def _record_metrics(state: dict, meters: dict, started: float):
+    """Snapshot every stage that has started, plus the run's wall time so far."""
+    for name, meter in meters.items():
+        if meter.start is not None:
+            state["metrics"][name] = meter.snapshot()
+    state["metrics"]["total"] = {"wall_sec": round(time.monotonic() - started, 3)}
+
+
+# Additive usage fields, split evenly over the clips of a render group
+_PER_CLIP_FIELDS = ("wall_sec", "cpu_sec", "child_cpu_sec", "read_bytes", "write_bytes")
+
+
+def _clip_shares(group: dict) -> list[dict]:
+    """One clip's share of a group pass, once per clip in the group."""
+    batch = max(group.get("batch", 1), 1)
+    share = {k: group[k] / batch for k in _PER_CLIP_FIELDS if k in group}
+    if "child_peak_rss_mb" in group:
+        share["child_peak_rss_mb"] = group["child_peak_rss_mb"]
+    return [share] * batch
+
+
+def stats() -> dict:
+    """
+    Stage, render-group and per-clip metrics aggregated across every run's state
+    file. A group's usage is recorded once; "clips" splits it over its clips.
+    """
+    stages: dict[str, list] = {}
+    groups, clips, statuses = [], [], {}
+    for path in PROCESSING_DIR.glob("*_state.json"):
+        try:
+            state = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        if not state.get("metrics"):
+            continue
+        statuses[state.get("status")] = statuses.get(state.get("status"), 0) + 1
+        for name, snapshot in state["metrics"].items():
+            stages.setdefault(name, []).append(snapshot)
+        for group in state.get("render", {}).get("groups", []):
+            groups.append(group)
+            clips += _clip_shares(group)
+    return {
+        "runs": sum(statuses.values()),
+        "status": statuses,
+        "stages": {name: metrics.summarize(snaps) for name, snaps in stages.items()},
+        "groups": metrics.summarize(groups),
+        "clips": metrics.summarize(clips),
+    }
+
+
+def _check_cancelled(job_id: str):
+    if is_cancelled(job_id):
+        raise RenderCancelled(f"Pipeline cancelled: {job_id}")
+
+
+def cancel_pipeline(job_id: str) -> bool:
+    """Cancel a running pipeline; the current clip's ffmpeg is killed immediately."""
+    return cancel(job_id)
+
+
 def run_pipeline(
     job_id: str,
     video_path: Path,
@@ -47,69 +184,249 @@ def run_pipeline(
     count: int,
     audience: str,
     ad_config: dict | None = None,
+    resume: bool = False,
 ):
+    # A resumed run carries over finished steps and artifacts from the last
+    # state file, as long as the source upload is the same file.
+    source = media_index.identity(video_path)
+    prev = load_state(job_id) if resume else {}
+    if prev.get("source") != source:
+        prev = {}
+    done = prev.get("steps", {})
+    prev_artifacts = prev.get("artifacts", {})
     state = {
         "job_id": job_id,
         "status": "running",
+        "video_path": str(video_path),
+        "source": source,
         "clip_types": clip_types,
         "add_narration": add_narration,
         "count": count,
         "audience": audience,
+        "ad_config": ad_config or {},
         "steps": {},
+        "artifacts": {},
+        "metrics": {},
         "clips": [],
     }
+    # One meter per stage; stages that fan out over pools span several threads
+    meters = {name: metrics.Meter() for name in ("audio", "transcribe", "detect", "render")}
+    started = time.monotonic()
+    if prev:
+        state["resumed_at"] = datetime.utcnow().isoformat()
     _save_state(job_id, state)
 
+    def reuse(name: str) -> Path | None:
+        """A previous run's artifact, if it still matches its checksum (else it's dropped)."""
+        entry = prev_artifacts.get(name)
+        if not entry:
+            return None
+        if _artifact_ok(entry):
+            state["artifacts"][name] = entry
+            return Path(entry["path"])
+        Path(entry["path"]).unlink(missing_ok=True)
+        return None
+
     try:
         # Step 1 — Extract audio
-        _emit(job_id, "audio", "running", "Extracting audio...")
-        audio_path = extract_audio(video_path, job_id)
+        with meters["audio"].span():
+            audio_path = reuse("audio") if done.get("audio") == "done" else None
+            if audio_path:
+                _emit(job_id, "audio", "done", "Audio reused from previous run", 25)
+            else:
+                _emit(job_id, "audio", "running", "Extracting audio...")
+                audio_path = extract_audio(video_path, job_id)
+                state["artifacts"]["audio"] = _artifact(audio_path)
+                _emit(job_id, "audio", "done", "Audio extracted", 25)
         state["steps"]["audio"] = "done"
+        _record_metrics(state, meters, started)
         _save_state(job_id, state)
-        _emit(job_id, "audio", "done", "Audio extracted", 25)
 
-        # Step 2 — Transcribe
-        _emit(job_id, "transcribe", "running", "Transcribing with Whisper...")
-        transcript = transcribe(audio_path, job_id)
-        state["steps"]["transcribe"] = "done"
-        _save_state(job_id, state)
-        _emit(job_id, "transcribe", "done", "Transcription complete", 50)
-
-        # Step 3 — Detect clips
-        _emit(job_id, "detect", "running", "Detecting clip candidates...")
-        candidates = detect_clips(transcript, job_id, clip_types, count, audience)
-        state["steps"]["detect"] = "done"
-        state["candidates"] = len(candidates)
-        _save_state(job_id, state)
-        _emit(job_id, "detect", "done", f"Found {len(candidates)} candidates", 75)
-
-        # Step 4 — Render
+        # Steps 2–4 stream into each other: every transcript window goes to
+        # one detection call per clip type, and every detection result is
+        # planned into render groups and submitted at once, so the first clips
+        # render while other types are detected and later windows transcribed.
         lib_dir = LIBRARY_DIR / job_id
         lib_dir.mkdir(parents=True, exist_ok=True)
-        _emit(job_id, "render", "running", "Rendering clips...")
+        types = [t for t in ("meme", "quote") if t in clip_types]
+        candidates: list[dict] = []
+        progress = _RenderProgress(job_id)
+        state["render"] = {"total": 0, "finished": [], "failed": [], "outputs": {},
+                           "groups": []}
+        events = SimpleQueue()
+        futures = set()
+        stop = threading.Event()
 
-        rendered = []
-        for i, clip in enumerate(candidates):
+        def _track(future, kind: str, payload=None):
+            futures.add(future)
+            future.add_done_callback(lambda f: events.put((kind, f, payload)))
+
+        def _transcribe():
             try:
-                out = render_clip(video_path, lib_dir, i + 1, clip, add_cta=add_narration)
-                clip["output_file"] = out.name
-                rendered.append(clip)
-                _emit(job_id, "render", "running",
-                      f"Rendered {i+1}/{len(candidates)}: {out.name}",
-                      75 + int(25 * (i + 1) / len(candidates)))
-            except Exception as e:
-                _emit(job_id, "render", "error", f"Clip {i+1} failed: {e}")
+                with meters["transcribe"].span():
+                    for i, part, _ in transcribe_windows(audio_path, job_id):
+                        if stop.is_set():
+                            return
+                        events.put(("window", i, part))
+            except BaseException as e:
+                events.put(("failed", e, None))
+                return
+            events.put(("transcribed", None, None))
+
+        def _detect(part: dict, clip_type: str):
+            with meters["detect"].span():
+                return detect_type(part, clip_type, per_window, audience)
+
+        def _render(group):
+            with meters["render"].span():
+                with metrics.measure() as meter:
+                    with tracking(job_id, on_progress=progress.for_group(group)):
+                        results = render_group(video_path, group, add_cta=add_narration)
+            # One pass renders the whole group: its usage is recorded once, per group
+            return results, {**meter.snapshot(), "batch": len(group),
+                             "clips": [spec["index"] for spec in group]}
 
+        def _land(results, usage: dict | None = None):
+            for i, result in results:
+                if isinstance(result, Exception):
+                    state["render"]["failed"].append(i)
+                    _emit(job_id, "render", "error", f"Clip {i} failed: {result}")
+                    continue
+                candidates[i - 1]["output_file"] = result.name
+                state["render"]["finished"].append(i)
+                outputs = state["render"]["outputs"]
+                outputs[str(i)] = outputs.get(str(i)) or _artifact(result)
+            if usage:
+                state["render"]["groups"].append(usage)
+            # Library order = score order, whatever order the groups finish in
+            state["clips"] = sorted((c for c in candidates if c.get("output_file")),
+                                    key=lambda c: c.get("score", 0), reverse=True)
+            _record_metrics(state, meters, started)
+            _save_state(job_id, state)
+            landed = len(state["render"]["finished"]) + len(state["render"]["failed"])
+            _emit(job_id, "render", "running",
+                  f"Rendered {landed}/{len(candidates)}",
+                  75 + int(25 * landed / max(len(candidates), 1)))
+
+        def _render_clips(clips: list[dict]):
+            first = len(candidates) + 1
+            candidates.extend(clips)
+            state["candidates"] = state["render"]["total"] = len(candidates)
+            groups, errors = plan_batch(video_path, lib_dir, clips, first_index=first)
+            # Outputs a previous run finished intact aren't rendered again
+            intact = [(s["index"], s["out"]) for g in groups for s in g
+                      if _output_ok(prev_outputs.get(str(s["index"])), s["out"])]
+            kept = {i for i, _ in intact}
+            for i in kept:
+                state["render"]["outputs"][str(i)] = prev_outputs[str(i)]
+            groups = [g for g in ([s for s in g if s["index"] not in kept] for g in groups) if g]
+            if errors or intact:
+                _land(errors + intact)
+            for group in groups:
+                progress.add_group(group)
+                _track(render_pool.submit(_render, group), "rendered", group)
+
+        if done.get("transcribe") == "done":
+            reuse("transcript")
+        if done.get("detect") == "done":
+            reuse("clips")
+        cached = load_cached_clips(job_id)
+        prev_outputs = prev.get("render", {}).get("outputs", {})
+        if cached is None:
+            # Fresh detection renumbers the candidates; older outputs are stale
+            for entry in prev_outputs.values():
+                Path(entry["path"]).unlink(missing_ok=True)
+            prev_outputs = {}
+        windows = 1 if cached is not None else window_count(audio_path)
+        per_window = max(1, math.ceil(count / windows))
+        transcribing = cached is None
+        detecting = 0
+        detect_pool = ThreadPoolExecutor(max_workers=DETECT_WORKERS,
+                                         thread_name_prefix="studio-detect")
+        try:
+            if cached is not None:
+                state["steps"]["transcribe"] = state["steps"]["detect"] = "done"
+                _emit(job_id, "detect", "done", f"Found {len(cached)} candidates", 75)
+                _render_clips(cached)
+            else:
+                _emit(job_id, "transcribe", "running", "Transcribing with Whisper...")
+                threading.Thread(target=_transcribe, daemon=True).start()
+
+            while transcribing or detecting or futures:
+                try:
+                    kind, item, payload = events.get(timeout=1.0)
+                except Empty:
+                    _check_cancelled(job_id)
+                    continue
+                _check_cancelled(job_id)
+                if kind == "failed":
+                    raise item
+                if kind == "window":
+                    state["windows"] = item + 1
+                    _save_state(job_id, state)
+                    _emit(job_id, "transcribe", "running",
+                          f"Transcribed window {item + 1}/{windows}",
+                          25 + int(25 * (item + 1) / windows))
+                    for clip_type in types:
+                        detecting += 1
+                        _track(detect_pool.submit(_detect, payload, clip_type), "detected")
+                elif kind == "transcribed":
+                    transcribing = False
+                    state["steps"]["transcribe"] = "done"
+                    transcript_path = PROCESSING_DIR / f"{job_id}_transcript.json"
+                    if transcript_path.exists():
+                        state["artifacts"]["transcript"] = _artifact(transcript_path)
+                    _record_metrics(state, meters, started)
+                    _save_state(job_id, state)
+                    _emit(job_id, "transcribe", "done", "Transcription complete", 50)
+                elif kind == "detected":
+                    futures.discard(item)
+                    detecting -= 1
+                    _render_clips(item.result())
+                    _emit(job_id, "detect", "running",
+                          f"Found {len(candidates)} candidates so far, rendering...")
+                elif kind == "rendered":
+                    futures.discard(item)
+                    results, usage = item.result()
+                    progress.finish_group(payload, len(results))
+                    _land(results, usage)
+
+                if not (transcribing or detecting) and "detect" not in state["steps"]:
+                    state["steps"]["detect"] = "done"
+                    # Saved in index order, so a resumed run numbers clips the same way
+                    save_clips(job_id, [{k: v for k, v in c.items()
+                                         if k != "output_file"}
+                                        for c in candidates])
+                    state["artifacts"]["clips"] = _artifact(PROCESSING_DIR / f"{job_id}_clips.json")
+                    _record_metrics(state, meters, started)
+                    _save_state(job_id, state)
+                    _emit(job_id, "detect", "done", f"Found {len(candidates)} candidates", 75)
+        except BaseException:
+            stop.set()
+            for future in futures:
+                future.cancel()
+            cancel(job_id)  # stop groups already rendering
+            wait(futures)
+            raise
+        finally:
+            detect_pool.shutdown(wait=False, cancel_futures=True)
+
+        rendered = state["clips"]
         state["steps"]["render"] = "done"
-        state["clips"] = rendered
         state["status"] = "done"
-        state["ad_config"] = ad_config or {}
+        _record_metrics(state, meters, started)
         _save_state(job_id, state)
         _emit(job_id, "render", "done", f"Done! {len(rendered)} clips ready", 100)
 
+    except RenderCancelled:
+        state["status"] = "cancelled"
+        _record_metrics(state, meters, started)
+        _save_state(job_id, state)
+        _emit(job_id, "cancelled", "error", "Pipeline cancelled")
     except Exception as e:
         state["status"] = "error"
         state["error"] = str(e)
+        _record_metrics(state, meters, started)
         _save_state(job_id, state)
         _emit(job_id, "error", "error", str(e))
 
@@ -122,12 +439,73 @@ def start_pipeline(
     count: int,
     audience: str,
     ad_config: dict | None = None,
+    resume: bool = False,
 ):
     """Launch pipeline in background thread."""
-    t = threading.Thread(
-        target=run_pipeline,
-        args=(job_id, video_path, clip_types, add_narration, count, audience, ad_config),
-        daemon=True,
-    )
+    def _run():
+        try:
+            # Every ffmpeg this run spawns is registered under job_id for cancel_pipeline
+            with tracking(job_id):
+                run_pipeline(job_id, video_path, clip_types, add_narration, count, audience,
+                             ad_config, resume=resume)
+        finally:
+            with _running_lock:
+                _running.discard(job_id)
+
+    with _running_lock:
+        _running.add(job_id)
+    t = threading.Thread(target=_run, daemon=True)
     t.start()
     return job_id
+
+
+# ── Resume ───────────────────────────────────────────────────────────────────
+
+_running: set[str] = set()
+_running_lock = threading.Lock()
+
+
+def is_running(job_id: str) -> bool:
+    with _running_lock:
+        return job_id in _running
+
+
+def find_upload(job_id: str) -> Path | None:
+    """The source video uploaded for `job_id`, if any."""
+    job_dir = UPLOADS_DIR / job_id
+    for ext in ("mp4", "mov", "avi", "mkv"):
+        videos = sorted(job_dir.glob(f"*.{ext}"))
+        if videos:
+            return videos[0]
+    return None
+
+
+def resume_pipeline(job_id: str, video_path: Path):
+    """
+    Re-run `job_id` with the parameters in its state file. Finished steps are
+    skipped and clips whose output is intact are kept; see run_pipeline.
+    """
+    state = load_state(job_id)
+    return start_pipeline(
+        job_id, video_path, state["clip_types"], state["add_narration"],
+        state["count"], state["audience"], state.get("ad_config") or None, resume=True,
+    )
+
+
+def resume_interrupted() -> list[str]:
+    """Resume every pipeline whose state file still says "running" (the server died mid-run)."""
+    resumed = []
+    for path in sorted(PROCESSING_DIR.glob("*_state.json")):
+        try:
+            state = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        job_id = state.get("job_id")
+        if state.get("status") != "running" or not job_id or is_running(job_id):
+            continue
+        video_path = Path(state["video_path"]) if state.get("video_path") else find_upload(job_id)
+        if not video_path or not video_path.exists():
+            continue
+        resume_pipeline(job_id, video_path)
+        resumed.append(job_id)
+    return resumed
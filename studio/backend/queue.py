@@ -1,66 +1,152 @@
-import json
+import logging
+import os
+import socket
 import threading
 import time
 import uuid
-from datetime import datetime, timezone
-from .config import QUEUE_FILE
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from .config import (QUEUE_FILE, QUEUE_DB, QUEUE_BACKEND, REVIEW_DIR, PUBLISHED_DIR,
+                     RENDER_WORKERS, QUEUE_POLL_SECONDS,
+                     LEASE_SECONDS, LEASE_HEARTBEAT_SECONDS, JOB_MAX_ATTEMPTS,
+                     STARVATION_SECONDS, QUEUE_ARCHIVE_AFTER_DAYS)
+from .job_store import JobStore, JsonJobStore, SqliteJobStore
+from . import render_cache
+from . import render_pool
+from . import queue_archive
+from . import sse as sse_bus
+from .renderer import (render_job, tracking, cancel as cancel_render, is_cancelled,
+                       RenderCancelled, PROFILES)
 
-_lock = threading.Lock()
+log = logging.getLogger(__name__)
+
+# Worker loop retry delay after an unexpected error, doubling up to the max
+WORKER_BACKOFF_SECONDS = 1.0
+WORKER_BACKOFF_MAX_SECONDS = 30.0
+
+_store: JobStore | None = None
+_store_lock = threading.Lock()
+
+# Bumped on every enqueue so idle workers wake immediately instead of polling
+_dispatch = threading.Condition()
+_dispatch_seq = 0
 
 
 def _now() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
+def get_store() -> JobStore:
+    """Return the configured job store, opening it on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if QUEUE_BACKEND == "json":
+                _store = JsonJobStore(QUEUE_FILE)
+            else:
+                _store = SqliteJobStore(QUEUE_DB, import_from=QUEUE_FILE)
+        return _store
+
+
+def _notify_workers():
+    global _dispatch_seq
+    with _dispatch:
+        _dispatch_seq += 1
+        _dispatch.notify_all()
+
+
+def _wait_for_work(seen_seq: int):
+    """Block until something is enqueued after `seen_seq`, or the fallback poll."""
+    with _dispatch:
+        _dispatch.wait_for(lambda: _dispatch_seq != seen_seq, timeout=QUEUE_POLL_SECONDS)
+
+
 def load_queue() -> list[dict]:
-    with _lock:
-        if not QUEUE_FILE.exists():
-            return []
-        try:
-            return json.loads(QUEUE_FILE.read_text())
-        except Exception:
-            return []
+    return get_store().all()
 
 
 def save_queue(jobs: list[dict]):
-    with _lock:
-        QUEUE_FILE.parent.mkdir(parents=True, exist_ok=True)
-        QUEUE_FILE.write_text(json.dumps(jobs, indent=2))
+    get_store().replace_all(jobs)
 
 
 def add_job(job: dict) -> dict:
-    jobs = load_queue()
-    jobs.append(job)
-    save_queue(jobs)
+    get_store().add(job)
+    _notify_workers()
     return job
 
 
+def add_jobs(jobs: list[dict]) -> list[dict]:
+    """Enqueue many jobs in a single store transaction."""
+    if jobs:
+        get_store().add_many(jobs)
+        _notify_workers()
+    return jobs
+
+
 def update_job(job_id: str, updates: dict) -> dict | None:
-    jobs = load_queue()
-    for job in jobs:
-        if job["id"] == job_id:
-            job.update(updates)
-            save_queue(jobs)
-            return job
-    return None
+    job = get_store().update(job_id, updates)
+    if job and updates.get("status") == "queued":
+        _notify_workers()
+    return job
 
 
 def get_job(job_id: str) -> dict | None:
-    for job in load_queue():
-        if job["id"] == job_id:
-            return job
-    return None
+    return get_store().get(job_id)
 
 
 def remove_job(job_id: str) -> bool:
-    jobs = load_queue()
-    new_jobs = [j for j in jobs if j["id"] != job_id]
-    if len(new_jobs) == len(jobs):
+    return get_store().remove(job_id)
+
+
+# Statuses a job never leaves on its own; these are what gets archived. Not
+# "review": a review job still waits on approve/reject, which needs its record.
+TERMINAL_STATUSES = ("published", "rejected", "failed")
+
+
+def archive_finished_jobs(max_age_days: float = QUEUE_ARCHIVE_AFTER_DAYS) -> int:
+    """Move terminal jobs completed more than `max_age_days` ago to the archive."""
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=max_age_days)).isoformat()
+    # created_at <= completed_at, so the indexed created_at filter is a safe pre-filter
+    old = [j for j in get_store().find(TERMINAL_STATUSES, cutoff)
+           if (j.get("completed_at") or j.get("created_at") or "") < cutoff]
+    if not old:
+        return 0
+    queue_archive.append(old)
+    return get_store().remove_many([j["id"] for j in old])
+
+
+def cancel_job(job_id: str) -> bool:
+    """
+    Remove a job; if it's rendering, kill its ffmpeg and delete the partial output.
+    Dropping the record first makes the worker's lease checks fail, so it stops
+    heartbeating and its final status write is a no-op.
+    """
+    job = get_job(job_id)
+    if not job or not remove_job(job_id):
         return False
-    save_queue(new_jobs)
+    # Not just when the snapshot says "rendering": a worker may have claimed
+    # the job since get_job(). cancel_render() is a no-op for untracked jobs.
+    if cancel_render(job_id) or job["status"] == "rendering":
+        _discard_partial(job)
+    _release_draft(job)
     return True
 
 
+def normalize_deadline(deadline: str | None) -> str | None:
+    """Accept YYYY-MM-DD (end of that day, UTC) or a full ISO timestamp."""
+    if not deadline:
+        return None
+    if not isinstance(deadline, str):
+        # e.g. a bare number from JSON; fromisoformat would raise TypeError
+        raise ValueError(f"deadline must be a date string, not {type(deadline).__name__}")
+    dt = datetime.fromisoformat(deadline)
+    if len(deadline) == 10:
+        dt = dt.replace(hour=23, minute=59, second=59)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc).isoformat()
+
+
 def build_job(
     mode: str,
     hook_clip_id: str,
@@ -76,8 +162,24 @@ def build_job(
     source_file: str,
     start_sec: int,
     duration_sec: int,
+    priority: int = 0,
+    deadline: str | None = None,
+    variants: list[dict] | None = None,
+    profile: str = "draft",
 ) -> dict:
-    return {
+    """
+    `variants` ([{caption, output_name?}, ...]) renders several captions of the
+    same clip range in one pass; hook_caption is then the first variant's.
+    `profile` is a renderer.PROFILES name — review renders default to draft.
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown render profile: {profile}")
+    if variants:
+        variants = [{"caption": v.get("caption") or hook_caption,
+                     "output_name": v.get("output_name") or f"{output_name}_v{i + 1}"}
+                    for i, v in enumerate(variants)]
+        hook_caption = variants[0]["caption"]
+    job = {
         "id": str(uuid.uuid4()),
         "status": "queued",
         "mode": mode,
@@ -97,24 +199,347 @@ def build_job(
         "source_file": source_file,
         "start_sec": start_sec,
         "duration_sec": duration_sec,
+        "attempts": 0,
+        "priority": priority,
+        "deadline": normalize_deadline(deadline),
+        "variants": variants,
+        "profile": profile,
+        "publish_on_finish": False,
     }
+    # The render cache holds single outputs; variant jobs still reuse cached bases
+    job["cache_key"] = None if variants else render_cache.job_key(job)
+    return job
+
+
+def _rendered(job: dict, filename: str) -> bool:
+    return filename in (job.get("output_files") or [job.get("output_file")])
+
+
+def job_for_output(filename: str) -> dict | None:
+    """
+    The job that rendered review file `filename` (newest first). Falls back to
+    the archive (review jobs archived before they stopped counting as
+    terminal) and puts a job found there back in the queue, so approving it
+    tracks its finals like any other draft.
+    """
+    jobs = list(reversed(load_queue()))
+    for job in jobs:
+        if _rendered(job, filename):
+            return job
+    # Jobs from before output_files/output_file were recorded
+    job = next((j for j in jobs if j.get("output_name")
+                and filename.startswith(j["output_name"])), None)
+    if job:
+        return job
+    job = queue_archive.find(lambda j: j.get("status") == "review" and _rendered(j, filename))
+    if job:
+        get_store().add(job)
+    return job
+
+
+def reject_output(job: dict, filename: str):
+    """`filename` was rejected; the job is done once none of its outputs are left in review."""
+    outputs = job.get("output_files") or [job.get("output_file")]
+    if not any((REVIEW_DIR / name).exists() for name in outputs if name and name != filename):
+        update_job(job["id"], {"status": "rejected", "completed_at": _now()})
+
+
+def promote_to_final(job: dict, filename: str) -> dict:
+    """
+    Queue a final-profile render of the same spec as draft `job` (just the
+    approved variant), written straight to published/ when it finishes.
+    """
+    variant = next((v for v in job.get("variants") or []
+                    if f"{v['output_name']}.mp4" == filename), None)
+    final = build_job(
+        mode=job["mode"],
+        hook_clip_id=job["hook_clip_id"],
+        hook_caption=variant["caption"] if variant else job["hook_caption"],
+        body_script=job["body_script"],
+        body_audio_file=job["body_audio_file"],
+        voice=job["voice"],
+        provider=job["provider"],
+        cta_tagline=job["cta_tagline"],
+        cta_subtitle=job["cta_subtitle"],
+        cta_url=job["cta_url"],
+        output_name=Path(filename).stem,
+        source_file=job["source_file"],
+        start_sec=job["start_sec"],
+        duration_sec=job["duration_sec"],
+        # Approved work jumps the queue
+        priority=int(job.get("priority") or 0) + 100,
+        deadline=job.get("deadline"),
+        profile="final",
+    )
+    final["publish_on_finish"] = True
+    final["draft_job_id"] = job["id"]
+    add_job(final)
+    # Tracked per output file: each variant of a draft is approved on its own
+    draft = get_job(job["id"]) or job
+    update_job(job["id"], {"finals": {**(draft.get("finals") or {}), filename: final["id"]}})
+    return final
+
+
+def pending_final(job: dict, filename: str) -> dict | None:
+    """The final render queued for draft output `filename`, while it's still in flight."""
+    final_id = (job.get("finals") or {}).get(filename)
+    final = get_job(final_id) if final_id else None
+    if final and final["status"] in ("queued", "rendering"):
+        return final
+    return None
+
+
+def _release_draft(final: dict):
+    """A final render failed or was dropped: let its draft output be approved again."""
+    draft = get_job(final["draft_job_id"]) if final.get("draft_job_id") else None
+    if not draft:
+        return
+    finals = {name: fid for name, fid in (draft.get("finals") or {}).items()
+              if fid != final["id"]}
+    update_job(draft["id"], {"finals": finals})
+
 
+# ── Scheduling ───────────────────────────────────────────────────────────────
 
-def start_processor():
-    def _process():
-        while True:
-            time.sleep(2)
-            jobs = load_queue()
-            queued = [j for j in jobs if j["status"] == "queued"]
-            if not queued:
+def _schedule_key(job: dict, now: datetime) -> tuple:
+    """
+    Sort key for queued jobs, lowest first:
+      1. starved jobs (queued longer than STARVATION_SECONDS), oldest first
+      2. jobs with a deadline, earliest deadline first
+      3. higher priority
+      4. FIFO
+    """
+    created = datetime.fromisoformat(job["created_at"])
+    starved = (now - created).total_seconds() >= STARVATION_SECONDS
+    deadline = job.get("deadline")
+    return (
+        0 if starved else 1,
+        created.isoformat() if starved else "",
+        0 if deadline else 1,
+        deadline or "",
+        -int(job.get("priority") or 0),
+        created.isoformat(),
+    )
+
+
+def pick_next(queued: list[dict]) -> dict:
+    now = datetime.now(timezone.utc)
+    return min(queued, key=lambda j: _schedule_key(j, now))
+
+
+# ── Worker pool ──────────────────────────────────────────────────────────────
+
+_workers: dict[str, dict] = {}
+_workers_lock = threading.Lock()
+
+# Lease owners are "<host>:<pid>/<worker>" so leases from a dead process are never ours
+_PROCESS_TAG = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def default_worker_count() -> int:
+    """One worker per render slot (see render_pool.capacity)."""
+    return render_pool.capacity()
+
+
+def worker_status() -> list[dict]:
+    with _workers_lock:
+        return [dict(w) for w in _workers.values()]
+
+
+def _set_worker(worker_id: str, **fields):
+    with _workers_lock:
+        _workers[worker_id].update(fields)
+
+
+def _lease_expiry() -> str:
+    return (datetime.now(timezone.utc) + timedelta(seconds=LEASE_SECONDS)).isoformat()
+
+
+def _owner(worker_id: str) -> str:
+    return f"{_PROCESS_TAG}/{worker_id}"
+
+
+def _claim_updates(owner: str):
+    def make(job: dict) -> dict:
+        return {"status": "rendering", "worker_id": owner, "started_at": _now(),
+                "lease_expires_at": _lease_expiry(), "attempts": job.get("attempts", 0) + 1}
+    return make
+
+
+def _output_paths(job: dict) -> list[Path]:
+    """Every file a render of `job` writes: one per caption variant, or <output_name>.mp4."""
+    out_dir = PUBLISHED_DIR if job.get("publish_on_finish") else REVIEW_DIR
+    names = [v["output_name"] for v in job.get("variants") or []] or [job.get("output_name")]
+    return [out_dir / f"{name}.mp4" for name in names if name]
+
+
+def _discard_partial(job: dict):
+    """
+    Remove half-written outputs left behind by a dead render. A final render
+    writes to published/ under its draft's name, so the approved draft in
+    review/ is left alone.
+    """
+    for out in _output_paths(job):
+        out.unlink(missing_ok=True)
+
+
+def recover_expired_leases() -> list[dict]:
+    """
+    Return rendering jobs whose lease has lapsed (dead worker or restarted
+    process) to the queue, or fail them once they've used up their attempts.
+    """
+    now = _now()
+    recovered = []
+    for job in get_store().by_status("rendering"):
+        if (job.get("lease_expires_at") or "") > now:
+            continue
+        max_attempts = job.get("max_attempts", JOB_MAX_ATTEMPTS)
+        if job.get("attempts", 0) >= max_attempts:
+            updates = {"status": "failed", "completed_at": now,
+                       "error": f"Lease expired after {max_attempts} attempts"}
+        else:
+            updates = {"status": "queued", "error": "Lease expired, retrying"}
+        updates.update(worker_id=None, lease_expires_at=None)
+        match = {"status": "rendering", "worker_id": job.get("worker_id"),
+                 "lease_expires_at": job.get("lease_expires_at")}
+        reclaimed = get_store().update_where(job["id"], match, updates)
+        if reclaimed:
+            _discard_partial(reclaimed)
+            if reclaimed["status"] == "failed":
+                _release_draft(reclaimed)
+            recovered.append(reclaimed)
+    if any(j["status"] == "queued" for j in recovered):
+        _notify_workers()
+    return recovered
+
+
+def _heartbeat(job_id: str, owner: str, stop: threading.Event):
+    renewed = time.monotonic()
+    while not stop.wait(LEASE_HEARTBEAT_SECONDS):
+        try:
+            held = get_store().update_where(job_id, {"status": "rendering", "worker_id": owner},
+                                            {"lease_expires_at": _lease_expiry()})
+        except Exception:
+            # e.g. "database is locked"; the lease stands until it expires, so
+            # keep trying until the last heartbeat before that
+            log.exception("Lease heartbeat for job %s failed", job_id)
+            if time.monotonic() - renewed < LEASE_SECONDS - LEASE_HEARTBEAT_SECONDS:
                 continue
-            job = queued[0]
-            update_job(job["id"], {"status": "rendering"})
-            try:
-                from .pipeline import run_pipeline
-                run_pipeline(job)
-                update_job(job["id"], {"status": "review", "completed_at": _now()})
-            except Exception as exc:
-                update_job(job["id"], {"status": "failed", "error": str(exc), "completed_at": _now()})
-
-    threading.Thread(target=_process, daemon=True).start()
+            held = False
+        if not held:
+            # The job was cancelled, or its lease expired and recovery requeued it
+            # (and deleted the partial output): stop rendering before another
+            # worker writes the same path
+            cancel_render(job_id)
+            return
+        renewed = time.monotonic()
+
+
+def _finish(job_id: str, lease: dict, updates: dict) -> bool:
+    """Apply `updates` if this worker still holds the lease; False if it was lost."""
+    if not get_store().update_where(job_id, lease, updates):
+        return False
+    sse_bus.emit(job_id, "job", {"status": updates["status"],
+                                 "error": updates.get("error")})
+    return True
+
+
+def _run_job(worker_id: str, job: dict):
+    owner = job["worker_id"]
+    lease = {"status": "rendering", "worker_id": owner}
+    _set_worker(worker_id, state="rendering", job_id=job["id"], since=_now())
+    sse_bus.emit(job["id"], "job", {"status": "rendering", "worker_id": worker_id})
+    stop = threading.Event()
+    threading.Thread(target=_heartbeat, args=(job["id"], owner, stop), daemon=True).start()
+
+    def on_progress(progress: dict):
+        get_store().update_where(job["id"], lease, {"progress": progress})
+        sse_bus.emit(job["id"], "progress", progress)
+
+    publish = bool(job.get("publish_on_finish"))
+    out_dir = PUBLISHED_DIR if publish else REVIEW_DIR
+    try:
+        outs = [out_dir / f"{job['output_name']}.mp4"]
+        cache_hit = render_cache.restore(job.get("cache_key"), outs[0])
+        if not cache_hit:
+            # Register before waiting for a slot (shared with pipeline renders), so
+            # a cancel that lands while this job waits still stops it
+            with tracking(job["id"], on_progress=on_progress), render_pool.slot():
+                if is_cancelled(job["id"]) or not get_job(job["id"]):
+                    raise RenderCancelled(f"Render cancelled: {job['id']}")
+                outs = render_job(job, out_dir)
+            render_cache.store(job.get("cache_key"), outs[0])
+        if publish:
+            # The final replaces the approved draft
+            (REVIEW_DIR / outs[0].name).unlink(missing_ok=True)
+            if job.get("draft_job_id"):
+                update_job(job["draft_job_id"], {"status": "published"})
+        _finish(job["id"], lease, {
+            "status": "published" if publish else "review", "output_file": outs[0].name,
+            "output_files": [o.name for o in outs], "cache_hit": cache_hit,
+            "error": None, "lease_expires_at": None, "completed_at": _now()})
+    except Exception as exc:
+        if _finish(job["id"], lease, {
+                "status": "failed", "error": str(exc), "lease_expires_at": None,
+                "completed_at": _now()}):
+            # A lost lease means the job was requeued (or cancelled, which
+            # releases the draft itself)
+            _release_draft(job)
+    finally:
+        stop.set()
+        _set_worker(worker_id, state="idle", job_id=None, since=_now())
+
+
+def _worker_loop(worker_id: str):
+    claim = _claim_updates(_owner(worker_id))
+    backoff = WORKER_BACKOFF_SECONDS
+    while True:
+        try:
+            seen_seq = _dispatch_seq
+            job = get_store().claim_next(claim, pick_next)
+            if job:
+                _run_job(worker_id, job)
+            else:
+                _wait_for_work(seen_seq)
+            backoff = WORKER_BACKOFF_SECONDS
+        except Exception as exc:
+            # e.g. "database is locked" past the SQLite timeout, or a bad job
+            # record; keep the worker alive and say so in worker_status()
+            log.exception("Queue worker %s failed; retrying in %.0fs", worker_id, backoff)
+            _set_worker(worker_id, state="error", job_id=None, since=_now(), error=str(exc))
+            time.sleep(backoff)
+            _set_worker(worker_id, state="idle", since=_now(), error=None)
+            backoff = min(backoff * 2, WORKER_BACKOFF_MAX_SECONDS)
+
+
+def _maintenance_loop():
+    """Reap expired leases every heartbeat; archive finished jobs hourly."""
+    last_archive = time.monotonic()
+    while True:
+        time.sleep(LEASE_HEARTBEAT_SECONDS)
+        try:
+            recover_expired_leases()
+            if time.monotonic() - last_archive >= 3600:
+                last_archive = time.monotonic()
+                archive_finished_jobs()
+        except Exception:
+            log.exception("Queue maintenance failed; retrying next heartbeat")
+
+
+def start_processor(workers: int | None = None):
+    """Start the render worker pool and queue maintenance thread (idempotent)."""
+    count = workers or RENDER_WORKERS or default_worker_count()
+    with _workers_lock:
+        if _workers:
+            return
+        for n in range(count):
+            worker_id = f"worker-{n + 1}"
+            _workers[worker_id] = {"id": worker_id, "state": "idle", "job_id": None,
+                                   "since": _now()}
+    # Anything still "rendering" from a previous process has no live heartbeat
+    recover_expired_leases()
+    archive_finished_jobs()
+    threading.Thread(target=_maintenance_loop, daemon=True, name="studio-queue-maint").start()
+    for worker_id in list(_workers):
+        threading.Thread(target=_worker_loop, args=(worker_id,), daemon=True,
+                         name=f"studio-{worker_id}").start()
@@ -0,0 +1,74 @@
+"""
+queue_archive.py — Cold storage for finished render jobs.
+
+Terminal jobs are moved out of the hot queue into gzip'd JSON-lines shards,
+one per completion day (queue_archive/YYYY-MM-DD.jsonl.gz). Shards are only
+ever appended to, so archiving never rewrites old history.
+"""
+import gzip
+import json
+import threading
+from collections import defaultdict
+
+from .config import QUEUE_ARCHIVE_DIR
+
+_lock = threading.Lock()
+
+
+def _shard_day(job: dict) -> str:
+    stamp = job.get("completed_at") or job.get("created_at") or ""
+    return stamp[:10] or "undated"
+
+
+def append(jobs: list[dict]):
+    """Append jobs to their day shards (gzip members concatenate cleanly)."""
+    by_day: dict[str, list[dict]] = defaultdict(list)
+    for job in jobs:
+        by_day[_shard_day(job)].append(job)
+    with _lock:
+        QUEUE_ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+        for day, day_jobs in by_day.items():
+            with gzip.open(QUEUE_ARCHIVE_DIR / f"{day}.jsonl.gz", "at") as f:
+                for job in day_jobs:
+                    f.write(json.dumps(job) + "\n")
+
+
+def _read_shard(path) -> list[dict]:
+    with gzip.open(path, "rt") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def history(offset: int = 0, limit: int = 50, status: str | None = None) -> dict:
+    """Archived jobs, newest day first. Only reads as many shards as the page needs."""
+    jobs: list[dict] = []
+    skipped = 0
+    has_more = False
+    with _lock:
+        shards = sorted(QUEUE_ARCHIVE_DIR.glob("*.jsonl.gz"), reverse=True) \
+            if QUEUE_ARCHIVE_DIR.exists() else []
+    for shard in shards:
+        for job in reversed(_read_shard(shard)):
+            if status and job.get("status") != status:
+                continue
+            if skipped < offset:
+                skipped += 1
+                continue
+            if len(jobs) == limit:
+                has_more = True
+                break
+            jobs.append(job)
+        if has_more:
+            break
+    return {"jobs": jobs, "offset": offset, "limit": limit, "has_more": has_more}
+
+
+def find(match) -> dict | None:
+    """The newest archived job for which match(job) is true."""
+    with _lock:
+        shards = sorted(QUEUE_ARCHIVE_DIR.glob("*.jsonl.gz"), reverse=True) \
+            if QUEUE_ARCHIVE_DIR.exists() else []
+    for shard in shards:
+        for job in reversed(_read_shard(shard)):
+            if match(job):
+                return job
+    return None
@@ -0,0 +1,298 @@
+"""
+render_backend.py — Pluggable implementations of the composited clip render.
+
+FfmpegBackend spawns one ffmpeg process per render (renderer._render_composited).
+PyAVBackend does the same decode → base filters → caption overlay → encode
+in-process with PyAV and keeps recently used source containers open, so
+consecutive clips from one upload skip process startup, probing and
+container open. Pipeline render groups (render_group) go through the backend
+too: ffmpeg cuts a group in one multi-output pass, PyAV renders its clips in
+turn from the open container. Selected with STUDIO_RENDER_BACKEND
+(ffmpeg | pyav); pyav falls back to ffmpeg when the `av` package isn't installed.
+"""
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from fractions import Fraction
+from pathlib import Path
+
+from .config import RENDER_BACKEND, PROGRESS_INTERVAL_SECONDS
+
+try:
+    import av
+except ImportError:  # optional dependency
+    av = None
+
+
+class RenderBackend:
+    """Renders one clip range into one output per (out, overlay_png)."""
+
+    name = ""
+
+    def composite(self, source: Path, start: float, duration: float,
+                  base_filters: list[str], outputs: list[tuple[Path, Path]], what: str,
+                  profile: str = "final"):
+        raise NotImplementedError
+
+    def render_group(self, source: Path, group: list[dict], add_cta: bool) -> list[tuple]:
+        """Render a renderer.plan_batch group; [(index, Path | Exception)] per clip."""
+        raise NotImplementedError
+
+
+class FfmpegBackend(RenderBackend):
+    name = "ffmpeg"
+
+    def composite(self, source, start, duration, base_filters, outputs, what, profile="final"):
+        from .renderer import _render_composited
+        _render_composited(source, start, duration, base_filters, outputs, what, profile)
+
+    def render_group(self, source, group, add_cta):
+        from .renderer import _render_group_pass
+        return _render_group_pass(source, group, add_cta)
+
+
+# ── PyAV ─────────────────────────────────────────────────────────────────────
+
+OPEN_SOURCES = 4           # containers kept open per render thread
+
+
+def _encode_options(encode: list[str]) -> tuple[str, dict]:
+    """["-c:v", "libx264", "-crf", "20", ...] → ("libx264", {"crf": "20", ...})."""
+    opts = dict(zip(encode[::2], encode[1::2]))
+    codec = opts.pop("-c:v", "libx264")
+    return codec, {k.lstrip("-"): v for k, v in opts.items()}
+
+
+def _filter(spec: str) -> tuple[str, str | None]:
+    name, _, args = spec.partition("=")
+    return name, args or None
+
+
+class PyAVBackend(RenderBackend):
+    name = "pyav"
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _open(self, source: Path):
+        """Thread-local LRU of open input containers, reopened if the file changed."""
+        cache = getattr(self._local, "sources", None)
+        if cache is None:
+            cache = self._local.sources = OrderedDict()
+        st = source.stat()
+        key = str(source.resolve())
+        sig = (st.st_size, st.st_mtime)
+        entry = cache.pop(key, None)
+        if entry and entry[0] != sig:
+            entry[1].close()
+            entry = None
+        if entry is None:
+            entry = (sig, av.open(key))
+        cache[key] = entry
+        while len(cache) > OPEN_SOURCES:
+            cache.popitem(last=False)[1][1].close()
+        return entry[1]
+
+    def _graph(self, vstream, base_filters: list[str], overlays: list[Path],
+               size: tuple[int, int] | None):
+        """buffer → base filters → split → overlay(caption at `size`) → yuv420p → sink, per output."""
+        from PIL import Image
+        graph = av.filter.Graph()
+        src = graph.add_buffer(template=vstream)
+        last = src
+        for spec in base_filters:
+            node = graph.add(*_filter(spec))
+            last.link_to(node)
+            last = node
+        split = graph.add("split", str(len(overlays)))
+        last.link_to(split)
+        pngs, sinks = [], []
+        for i, png in enumerate(overlays):
+            with Image.open(png) as img:
+                rgba = img.convert("RGBA")
+            if size:
+                rgba = rgba.resize(size, Image.BILINEAR)
+            # from_image() would drop the alpha channel (it converts to rgb24)
+            frame = av.VideoFrame.from_bytes(rgba.tobytes(), rgba.width, rgba.height,
+                                             format="rgba")
+            frame.pts = 0
+            frame.time_base = vstream.time_base
+            ov_src = graph.add_buffer(width=frame.width, height=frame.height, format="rgba",
+                                      time_base=vstream.time_base)
+            overlay = graph.add("overlay", "0:0:eof_action=repeat")
+            split.link_to(overlay, i, 0)
+            ov_src.link_to(overlay, 0, 1)
+            fmt = graph.add("format", "yuv420p")
+            overlay.link_to(fmt)
+            sink = graph.add("buffersink")
+            fmt.link_to(sink)
+            pngs.append((ov_src, frame))
+            sinks.append(sink)
+        graph.configure()
+        for ov_src, frame in pngs:
+            ov_src.push(frame)
+            ov_src.push(None)
+        # Callers must keep `graph` referenced: its contexts don't keep it alive
+        return graph, src, sinks
+
+    def render_group(self, source, group, add_cta):
+        from .renderer import RenderCancelled, render_clip, tracking, _local as render_local
+        job_id = getattr(render_local, "job_id", None)
+        on_progress = getattr(render_local, "on_progress", None)
+
+        def scaled(n: int):
+            # Each clip reports 0-100%; the group's callback wants the whole group
+            def report(progress: dict):
+                on_progress({**progress, "percent": round(
+                    (100 * n + (progress.get("percent") or 0.0)) / len(group), 1)})
+            return report
+
+        results = []
+        for n, spec in enumerate(group):
+            scope = (tracking(job_id, on_progress=scaled(n)) if job_id and on_progress
+                     else nullcontext())
+            try:
+                with scope:
+                    results.append((spec["index"], render_clip(source, spec["out"].parent,
+                                                               spec["index"], spec["clip"],
+                                                               add_cta)))
+            except RenderCancelled:
+                raise
+            except Exception as e:
+                results.append((spec["index"], e))
+        return results
+
+    def composite(self, source, start, duration, base_filters, outputs, what, profile="final"):
+        from .renderer import encoder_threads
+        with encoder_threads(len(outputs)) as threads:
+            self._composite(source, start, duration, base_filters, outputs, what, profile,
+                            int(threads[1]))
+
+    def _composite(self, source, start, duration, base_filters, outputs, what, profile,
+                   threads):
+        from .renderer import (OW, OH, PROFILES, RenderCancelled, is_cancelled, _base_path,
+                               profile_filters, _local as render_local, _progress_snapshot)
+        # A cached base segment already has the base filters (and scale) applied
+        base = _base_path(source, start, duration, base_filters, profile)
+        if base.exists():
+            source, start, base_filters = base, 0.0, []
+        else:
+            base_filters = profile_filters(base_filters, profile)
+        end = start + duration
+        container = self._open(Path(source))
+        vstream = container.streams.video[0]
+        astream = container.streams.audio[0] if container.streams.audio else None
+        job_id = getattr(render_local, "job_id", None)
+        on_progress = getattr(render_local, "on_progress", None)
+
+        size = PROFILES[profile]["scale"]
+        codec, options = _encode_options(PROFILES[profile]["encode"])
+        rate = vstream.average_rate or Fraction(30)
+        graph, src, sinks = self._graph(vstream, base_filters, [png for _, png in outputs], size)
+
+        writers = []
+        for out, _ in outputs:
+            oc = av.open(str(out), "w", options={"movflags": "+faststart"})
+            ov = oc.add_stream(codec, rate=rate, options=options)
+            ov.width, ov.height = size or (OW, OH)
+            ov.pix_fmt = "yuv420p"
+            ov.codec_context.thread_count = threads
+            oa = None
+            if astream is not None:
+                oa = oc.add_stream("aac", rate=48000)
+                oa.layout = "stereo"
+                oa.bit_rate = 128000
+            writers.append((oc, ov, oa))
+
+        def mux(oc, stream, frame):
+            for packet in stream.encode(frame):
+                oc.mux(packet)
+
+        def drain():
+            """Encode whatever each output branch of the graph has ready."""
+            for sink, (oc, ov, _) in zip(sinks, writers):
+                while True:
+                    try:
+                        out_frame = sink.pull()
+                    except (BlockingIOError, av.error.EOFError):
+                        break
+                    out_frame.pts = round((out_frame.time - start) * rate)
+                    out_frame.time_base = 1 / rate
+                    mux(oc, ov, out_frame)
+
+        t0 = time.monotonic()
+        last_report = 0.0
+        frames = 0
+        try:
+            container.seek(int(start / vstream.time_base), stream=vstream, backward=True)
+            streams = [s for s in (vstream, astream) if s is not None]
+            v_done = False
+            a_done = astream is None
+            for packet in container.demux(*streams):
+                if v_done and a_done:
+                    break
+                for frame in packet.decode():
+                    t = frame.time
+                    if t is None or t < start - 1e-6:
+                        continue
+                    if t >= end - 1e-6:
+                        if packet.stream is vstream:
+                            v_done = True
+                        else:
+                            a_done = True
+                        continue
+                    if packet.stream is astream:
+                        frame.pts = round((t - start) * frame.sample_rate)
+                        frame.time_base = Fraction(1, frame.sample_rate)
+                        for oc, _, oa in writers:
+                            mux(oc, oa, frame)
+                        continue
+                    src.push(frame)
+                    drain()
+                    frames += 1
+                    if job_id and is_cancelled(job_id):
+                        raise RenderCancelled(f"Render cancelled: {job_id}")
+                    now = time.monotonic()
+                    if on_progress and now - last_report >= PROGRESS_INTERVAL_SECONDS:
+                        last_report = now
+                        elapsed = now - t0
+                        block = {"out_time_us": str(int((t - start) * 1e6)),
+                                 "fps": f"{frames / elapsed:.1f}",
+                                 "speed": f"{(t - start) / elapsed:.2f}x"}
+                        try:
+                            on_progress(_progress_snapshot(block, duration, done=False))
+                        except Exception:
+                            pass
+            if not frames:
+                # e.g. a start past the end that clamp_range couldn't catch (no duration)
+                raise RuntimeError(f"{what} render failed: no video frames from {start:.1f}s")
+            src.push(None)
+            drain()
+            for oc, ov, oa in writers:
+                mux(oc, ov, None)
+                if oa is not None:
+                    mux(oc, oa, None)
+        except BaseException:
+            for oc, _, _ in writers:
+                oc.close()
+            for out, _ in outputs:
+                out.unlink(missing_ok=True)
+            raise
+        for oc, _, _ in writers:
+            oc.close()
+        if on_progress:
+            on_progress(_progress_snapshot({}, duration, done=True))
+
+
+_backend: RenderBackend | None = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> RenderBackend:
+    """The configured backend (pyav degrades to ffmpeg without PyAV installed)."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = PyAVBackend() if RENDER_BACKEND == "pyav" and av else FfmpegBackend()
+        return _backend
@@ -0,0 +1,61 @@
+"""
+render_cache.py — Content-addressed cache of finished renders.
+
+A job's cache key hashes everything that affects the output pixels (source
+identity, clip range, mode, caption, CTA, voice, renderer version). Finished
+renders are hard-linked into RENDER_CACHE_DIR as <key>.mp4, so an identical
+resubmission is served by linking the cached file back into studio/review/
+even after the original was approved, moved or rejected.
+Eviction is LRU by mtime, capped at RENDER_CACHE_MAX_MB.
+"""
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+from .config import RENDER_CACHE_DIR, RENDER_CACHE_MAX_MB
+from .file_cache import link, evict_lru
+from . import media_index
+
+_lock = threading.Lock()
+
+KEY_FIELDS = ("mode", "start_sec", "duration_sec", "hook_caption", "body_script",
+              "cta_tagline", "cta_subtitle", "cta_url", "voice", "provider", "profile")
+
+
+def job_key(job: dict) -> str:
+    from .renderer import RENDERER_VERSION
+    payload = {k: job.get(k) for k in KEY_FIELDS}
+    # Same notion of "same source" as the base cache (float mtime, resolved path)
+    payload["source"] = media_index.identity(job.get("source_file", ""))
+    payload["renderer"] = RENDERER_VERSION
+    blob = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode()).hexdigest()[:32]
+
+
+def _entry(key: str) -> Path:
+    return RENDER_CACHE_DIR / f"{key}.mp4"
+
+
+def restore(key: str | None, out: Path) -> bool:
+    """If `key` is cached, place it at `out` and mark it recently used."""
+    if not key:
+        return False
+    entry = _entry(key)
+    with _lock:
+        if not entry.exists():
+            return False
+        os.utime(entry)
+        link(entry, out)
+    return True
+
+
+def store(key: str | None, rendered: Path):
+    """Add a finished render to the cache, then evict down to the size cap."""
+    if not key or not rendered.exists():
+        return
+    with _lock:
+        link(rendered, _entry(key))
+        evict_lru(RENDER_CACHE_DIR, RENDER_CACHE_MAX_MB)
+
@@ -0,0 +1,63 @@
+"""
+render_pool.py — Render capacity shared by queue workers and pipelines.
+
+Every ffmpeg-heavy render holds one slot while it runs, so queue jobs and
+pipeline candidates together never run more than capacity() renders at once
+(one per FFMPEG_THREADS cores by default). Pipelines fan work out through
+submit(); queue workers take a slot around each job. A render that can split
+itself (chunked encodes) borrows whatever slots are idle with spare().
+"""
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
+from .config import RENDER_WORKERS, FFMPEG_THREADS
+
+
+def capacity() -> int:
+    """RENDER_WORKERS, or one render per FFMPEG_THREADS cores (at least one)."""
+    return RENDER_WORKERS or max(1, (os.cpu_count() or 1) // max(1, FFMPEG_THREADS))
+
+
+_slots = threading.BoundedSemaphore(capacity())
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+@contextmanager
+def slot():
+    """Hold one render slot for the duration of the block."""
+    _slots.acquire()
+    try:
+        yield
+    finally:
+        _slots.release()
+
+
+@contextmanager
+def spare(n: int):
+    """Take up to n more slots without waiting; yields how many were taken."""
+    taken = 0
+    while taken < n and _slots.acquire(blocking=False):
+        taken += 1
+    try:
+        yield taken
+    finally:
+        for _ in range(taken):
+            _slots.release()
+
+
+def _run_in_slot(fn, args, kwargs):
+    with slot():
+        return fn(*args, **kwargs)
+
+
+def submit(fn, *args, **kwargs) -> Future:
+    """Run fn(*args, **kwargs) on the shared pool once a render slot is free."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=capacity(),
+                                           thread_name_prefix="studio-render")
+    return _executor.submit(_run_in_slot, fn, args, kwargs)
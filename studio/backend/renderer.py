@@ -2,11 +2,35 @@
 renderer.py — ffmpeg rendering for meme clips and speaker quotes
 Output: 1080x1920 (9:16), black background
 """
+import hashlib
+import json
 import os
+import shutil
+import signal
 import subprocess
 import textwrap
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
 
+from PIL import Image, ImageDraw, ImageFont
+
+from .config import (FFMPEG_THREADS, PROGRESS_INTERVAL_SECONDS, OVERLAY_CACHE_DIR,
+                     OVERLAY_CACHE_MAX_MB, BASE_CACHE_DIR, BASE_CACHE_MAX_MB, SEGMENT_CACHE_DIR,
+                     SEGMENT_CACHE_MAX_MB, CHUNK_SECONDS, CHUNK_WORKERS)
+from . import file_cache
+from . import media_index
+from . import metrics
+from . import render_backend
+from . import render_pool
+
+# Bump whenever output pixels change for the same inputs (invalidates render_cache)
+RENDERER_VERSION = "3"
+# Bump whenever caption/CTA rasterisation changes (invalidates cached overlay PNGs)
+OVERLAY_LAYOUT_VERSION = 1
+
 FONT_IMPACT   = "/System/Library/Fonts/Supplemental/Impact.ttf"
 FONT_HELVETICA = "/System/Library/Fonts/Helvetica.ttc"
 OW, OH        = 1080, 1920
@@ -16,22 +40,191 @@ VIDEO_BOT     = VY + VH           # = 1264
 BORDER        = 6
 MAX_FONT      = 76
 MIN_FONT      = 44
-CHAR_W_RATIO  = 0.50
 CANVAS_W      = OW - 60
-CTA_COLOR     = "0xD97D55"
+CTA_COLOR     = "#D97D55"
 CTA_FONT_SIZE1 = 34
 CTA_FONT_SIZE2 = 42
 CTA_LINE1     = "The PM for AI Agents"
 CTA_LINE2     = "crowdlisten.com"
 
 
-def _esc(t: str) -> str:
-    return (t
-            .replace("\\", "\\\\")
-            .replace("'", "\u2019")
-            .replace("\u2018", "\u2019")
-            .replace(":", "\\:")
-            .replace(",", "\\,"))
+# ── Process tracking (cancellation) ──────────────────────────────────────────
+# Every ffmpeg spawned inside `tracking(job_id)` is registered under that job,
+# so cancel(job_id) can kill its process group from another thread.
+
+class RenderCancelled(RuntimeError):
+    pass
+
+
+_local = threading.local()
+_procs_lock = threading.Lock()
+_active: dict[str, int] = {}                     # job_id → nesting depth
+_procs: dict[str, set[subprocess.Popen]] = {}
+_cancelled: set[str] = set()
+
+
+@contextmanager
+def tracking(job_id: str, on_progress=None):
+    """
+    Attribute ffmpeg processes started in this thread to `job_id`.
+    `on_progress(dict)` receives throttled progress for renders of known length.
+    """
+    prev = getattr(_local, "job_id", None), getattr(_local, "on_progress", None)
+    _local.job_id = job_id
+    _local.on_progress = on_progress or (prev[1] if prev[0] == job_id else None)
+    with _procs_lock:
+        _active[job_id] = _active.get(job_id, 0) + 1
+    try:
+        yield
+    finally:
+        _local.job_id, _local.on_progress = prev
+        with _procs_lock:
+            _active[job_id] -= 1
+            if not _active[job_id]:
+                del _active[job_id]
+                _cancelled.discard(job_id)
+
+
+def is_cancelled(job_id: str) -> bool:
+    with _procs_lock:
+        return job_id in _cancelled
+
+
+def cancel(job_id: str) -> bool:
+    """Kill every running ffmpeg for `job_id`. Returns False if it isn't rendering."""
+    with _procs_lock:
+        if job_id not in _active:
+            return False
+        _cancelled.add(job_id)
+        procs = list(_procs.get(job_id, ()))
+    for proc in procs:
+        _kill_tree(proc)
+    return True
+
+
+def _kill_tree(proc: subprocess.Popen):
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(timeout=3)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def _float(value: str | None) -> float | None:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _progress_snapshot(block: dict, duration: float, done: bool) -> dict:
+    """Turn one `-progress` key=value block into percent / fps / speed / ETA."""
+    out_us = _float(block.get("out_time_us") or block.get("out_time_ms")) or 0.0
+    out_time = max(0.0, out_us / 1_000_000)
+    speed = _float(block.get("speed", "").rstrip("x"))
+    if done:
+        percent, eta = 100.0, 0.0
+    else:
+        percent = min(99.9, 100 * out_time / duration)
+        eta = (duration - out_time) / speed if speed else None
+    return {
+        "percent": round(percent, 1),
+        "fps": _float(block.get("fps")),
+        "speed": speed,
+        "eta_sec": round(max(eta, 0.0), 1) if eta is not None else None,
+        "out_time_sec": round(out_time, 2),
+    }
+
+
+def _communicate_with_progress(proc: subprocess.Popen, duration: float,
+                               on_progress) -> tuple[str, str]:
+    """Read `-progress pipe:1` from stdout while draining stderr on a side thread."""
+    stderr_chunks: list[str] = []
+    drain = threading.Thread(target=lambda: stderr_chunks.append(proc.stderr.read()),
+                             daemon=True)
+    drain.start()
+    block: dict = {}
+    last = 0.0
+    for line in proc.stdout:
+        key, _, value = line.strip().partition("=")
+        block[key] = value
+        if key != "progress":
+            continue
+        now = time.monotonic()
+        if value == "end" or now - last >= PROGRESS_INTERVAL_SECONDS:
+            last = now
+            try:
+                on_progress(_progress_snapshot(block, duration, done=value == "end"))
+            except Exception:
+                pass
+        block = {}
+    metrics.reap(proc)
+    drain.join()
+    return "", "".join(stderr_chunks)
+
+
+def _communicate(proc: subprocess.Popen) -> tuple[str, str]:
+    """proc.communicate(), but reaped through metrics so the child's usage is recorded."""
+    stderr_chunks: list[str] = []
+    drain = threading.Thread(target=lambda: stderr_chunks.append(proc.stderr.read()),
+                             daemon=True)
+    drain.start()
+    stdout = proc.stdout.read()
+    metrics.reap(proc)
+    drain.join()
+    return stdout, "".join(stderr_chunks)
+
+
+def _run_ffmpeg(cmd: list[str], out: Path,
+                duration: float | None = None) -> subprocess.CompletedProcess:
+    """
+    subprocess.run replacement that registers the process for cancellation.
+    With a known output `duration` and a progress callback from tracking(),
+    ffmpeg also reports machine-readable progress on stdout.
+    """
+    job_id = getattr(_local, "job_id", None)
+    on_progress = getattr(_local, "on_progress", None) if duration else None
+    if job_id and is_cancelled(job_id):
+        raise RenderCancelled(f"Render cancelled: {job_id}")
+    if on_progress:
+        cmd = cmd[:1] + ["-progress", "pipe:1", "-nostats"] + cmd[1:]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            text=True, start_new_session=True)
+    if job_id:
+        with _procs_lock:
+            _procs.setdefault(job_id, set()).add(proc)
+    try:
+        if on_progress:
+            stdout, stderr = _communicate_with_progress(proc, duration, on_progress)
+        else:
+            stdout, stderr = _communicate(proc)
+    finally:
+        if job_id:
+            with _procs_lock:
+                _procs[job_id].discard(proc)
+                if not _procs[job_id]:
+                    del _procs[job_id]
+    if job_id and is_cancelled(job_id):
+        out.unlink(missing_ok=True)
+        raise RenderCancelled(f"Render cancelled: {job_id}")
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+
+def seek_args(source: Path, start: float) -> tuple[list[str], list[str]]:
+    """
+    Input/output -ss pair for an accurate cut at `start`: jump straight to the
+    preceding keyframe (input seek, no decode), then trim the remaining
+    < 1 GOP on the output side. Decode cost no longer grows with `start`.
+    """
+    kf = media_index.keyframe_before(source, start)
+    if kf is None:
+        # No index (probe failed) — let ffmpeg's own accurate input seek handle it
+        return ["-ss", f"{start:.3f}"], []
+    pre = ["-ss", f"{kf:.3f}"] if kf > 0 else []
+    post = ["-ss", f"{start - kf:.3f}"] if start - kf > 0.001 else []
+    return pre, post
 
 
 def _auto_wrap(text: str, max_chars: int = 26) -> list[str]:
@@ -41,186 +234,621 @@ def _auto_wrap(text: str, max_chars: int = 26) -> list[str]:
     return result
 
 
-def _font_size(lines: list[str]) -> int:
-    max_len = max(len(l) for l in lines) if lines else 1
-    return max(MIN_FONT, min(MAX_FONT, int(CANVAS_W / (max_len * CHAR_W_RATIO))))
+# ── Caption overlays ─────────────────────────────────────────────────────────
+# Captions and CTA are rasterised once with Pillow (real glyph metrics) into a
+# transparent 1080x1920 PNG, cached by a hash of text+font+layout, and composited
+# with one overlay filter instead of a drawtext filter per line.
 
+def _font(path: str, size: int) -> ImageFont.FreeTypeFont:
+    try:
+        return ImageFont.truetype(path, size)
+    except OSError:
+        return ImageFont.load_default(size)
 
-def _render_meme(source: Path, out: Path, start: float, duration: float,
-                 caption: str, add_cta: bool = False):
+
+def _fit_font_size(lines: list[str], font_path: str) -> int:
+    """Largest size in [MIN_FONT, MAX_FONT] whose widest line fits CANVAS_W."""
+    for size in range(MAX_FONT, MIN_FONT - 1, -2):
+        font = _font(font_path, size)
+        if all(font.getlength(l) + 2 * BORDER <= CANVAS_W for l in lines):
+            return size
+    return MIN_FONT
+
+
+def _item(text: str, font: str, size: int, y: int, fill: str = "#FFFFFF",
+          stroke: int = 0, stroke_fill: str = "#000000") -> dict:
+    return {"text": text, "font": font, "size": size, "y": y, "fill": fill,
+            "stroke": stroke, "stroke_fill": stroke_fill}
+
+
+def _meme_caption_items(caption: str) -> list[dict]:
     lines = _auto_wrap(caption)
-    fs = _font_size(lines)
+    fs = _fit_font_size(lines, FONT_IMPACT)
     lh = fs + 10
-    block_h = len(lines) * lh
-    block_y = max((VY - block_h) // 2, 24)
-
-    filters = [
-        f"scale={OW}:-2",
-        f"pad={OW}:{OH}:(ow-iw)/2:(oh-ih)/2:black",
+    block_y = max((VY - len(lines) * lh) // 2, 24)
+    return [_item(line, FONT_IMPACT, fs, block_y + i * lh, stroke=BORDER)
+            for i, line in enumerate(lines)]
+
+
+def _meme_cta_items() -> list[dict]:
+    cta_block_h = CTA_FONT_SIZE1 + 10 + CTA_FONT_SIZE2 + 10
+    text_top = VIDEO_BOT + (OH - VIDEO_BOT - cta_block_h) // 2
+    return [
+        _item(CTA_LINE1, FONT_HELVETICA, CTA_FONT_SIZE1, text_top, CTA_COLOR, 3),
+        _item(CTA_LINE2, FONT_HELVETICA, CTA_FONT_SIZE2, text_top + CTA_FONT_SIZE1 + 10,
+              stroke=3),
     ]
 
-    for i, line in enumerate(lines):
-        filters.append(
-            f"drawtext=fontfile='{FONT_IMPACT}':text='{_esc(line)}':fontcolor=white"
-            f":fontsize={fs}:borderw={BORDER}:bordercolor=black"
-            f":x=(w-text_w)/2:y={block_y + i * lh}"
-        )
-
-    if add_cta:
-        bottom_space = OH - VIDEO_BOT
-        cta_block_h = CTA_FONT_SIZE1 + 10 + CTA_FONT_SIZE2 + 10
-        text_top = VIDEO_BOT + (bottom_space - cta_block_h) // 2
-        filters.append(
-            f"drawtext=fontfile='{FONT_HELVETICA}':text='{_esc(CTA_LINE1)}'"
-            f":fontcolor={CTA_COLOR}:fontsize={CTA_FONT_SIZE1}"
-            f":borderw=3:bordercolor=black:x=(w-text_w)/2:y={text_top}"
-        )
-        filters.append(
-            f"drawtext=fontfile='{FONT_HELVETICA}':text='{_esc(CTA_LINE2)}'"
-            f":fontcolor=white:fontsize={CTA_FONT_SIZE2}"
-            f":borderw=3:bordercolor=black:x=(w-text_w)/2:y={text_top + CTA_FONT_SIZE1 + 10}"
-        )
-
-    r = subprocess.run([
-        "ffmpeg", "-y", "-i", str(source),
-        "-ss", str(start), "-t", str(duration),
-        "-vf", ",".join(filters),
-        "-map", "0:v", "-map", "0:a",
-        "-c:v", "libx264", "-crf", "20", "-preset", "fast",
-        "-c:a", "aac", "-b:a", "128k", "-movflags", "+faststart", str(out),
-    ], capture_output=True, text=True)
-    if r.returncode != 0:
-        raise RuntimeError(f"Meme render failed: {r.stderr[-300:]}")
-
 
-def _render_quote(source: Path, out: Path, start: float, duration: float,
-                  quote: str, add_cta: bool = False):
+def _quote_caption_items(quote: str) -> list[dict]:
     lines = _auto_wrap(quote, max_chars=32)
     fs = 52
     lh = fs + 14
-    block_h = len(lines) * lh
-    block_y = (OH - block_h) // 2
-
-    filters = [
-        f"scale={OW}:{OH}:force_original_aspect_ratio=increase",
-        f"crop={OW}:{OH}",
-        # dark overlay
-        f"drawbox=x=0:y=0:w={OW}:h={OH}:color=black@0.55:t=fill",
+    block_y = (OH - len(lines) * lh) // 2
+    return [_item(line, FONT_HELVETICA, fs, block_y + i * lh, stroke=3,
+                  stroke_fill="#000000CC")
+            for i, line in enumerate(lines)]
+
+
+def _quote_cta_items() -> list[dict]:
+    cta_y = OH - 140
+    return [
+        _item(CTA_LINE1, FONT_HELVETICA, 30, cta_y, CTA_COLOR, 2),
+        _item(CTA_LINE2, FONT_HELVETICA, 36, cta_y + 40, stroke=2),
     ]
 
-    for i, line in enumerate(lines):
-        filters.append(
-            f"drawtext=fontfile='{FONT_HELVETICA}':text='{_esc(line)}':fontcolor=white"
-            f":fontsize={fs}:borderw=3:bordercolor=black@0.8"
-            f":x=(w-text_w)/2:y={block_y + i * lh}"
-        )
-
-    if add_cta:
-        cta_y = OH - 140
-        filters.append(
-            f"drawtext=fontfile='{FONT_HELVETICA}':text='{_esc(CTA_LINE1)}'"
-            f":fontcolor={CTA_COLOR}:fontsize=30:borderw=2:bordercolor=black"
-            f":x=(w-text_w)/2:y={cta_y}"
-        )
-        filters.append(
-            f"drawtext=fontfile='{FONT_HELVETICA}':text='{_esc(CTA_LINE2)}'"
-            f":fontcolor=white:fontsize=36:borderw=2:bordercolor=black"
-            f":x=(w-text_w)/2:y={cta_y + 40}"
-        )
-
-    r = subprocess.run([
-        "ffmpeg", "-y", "-i", str(source),
-        "-ss", str(start), "-t", str(duration),
-        "-vf", ",".join(filters),
-        "-map", "0:v", "-map", "0:a",
-        "-c:v", "libx264", "-crf", "20", "-preset", "fast",
-        "-c:a", "aac", "-b:a", "128k", "-movflags", "+faststart", str(out),
-    ], capture_output=True, text=True)
-    if r.returncode != 0:
-        raise RuntimeError(f"Quote render failed: {r.stderr[-300:]}")
 
+def _cache_png(key_data, draw) -> Path:
+    key = hashlib.sha256(json.dumps(key_data, sort_keys=True).encode()).hexdigest()[:32]
+    path = OVERLAY_CACHE_DIR / f"{key}.png"
+    if path.exists():
+        os.utime(path)  # LRU touch, so a layer about to be composited isn't evicted
+        return path
+    OVERLAY_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    # Not *.png, so eviction never deletes another thread's layer mid-write
+    tmp = path.with_name(f"{key}.{threading.get_ident()}.png.part")
+    draw().save(tmp, format="PNG")
+    os.replace(tmp, path)
+    file_cache.evict_lru(OVERLAY_CACHE_DIR, OVERLAY_CACHE_MAX_MB, pattern="*.png")
+    return path
+
+
+def _text_layer(items: list[dict]) -> Path:
+    """Transparent OWxOH PNG with each item centred horizontally at its y."""
+    def draw() -> Image.Image:
+        img = Image.new("RGBA", (OW, OH), (0, 0, 0, 0))
+        d = ImageDraw.Draw(img)
+        for it in items:
+            d.text((OW / 2, it["y"]), it["text"], font=_font(it["font"], it["size"]),
+                   fill=it["fill"], stroke_width=it["stroke"], stroke_fill=it["stroke_fill"],
+                   anchor="ma")
+        return img
+    return _cache_png({"v": OVERLAY_LAYOUT_VERSION, "items": items}, draw)
+
+
+def caption_overlay(caption_items: list[dict], cta_items: list[dict] | None = None) -> Path:
+    """
+    Cached caption (+ CTA) overlay PNG. The CTA layer is cached on its own, so it
+    is rasterised once and reused for every caption it's combined with.
+    """
+    caption_png = _text_layer(caption_items)
+    if not cta_items:
+        return caption_png
+    cta_png = _text_layer(cta_items)
+
+    def draw() -> Image.Image:
+        with Image.open(caption_png) as cap, Image.open(cta_png) as cta:
+            return Image.alpha_composite(cap.convert("RGBA"), cta.convert("RGBA"))
+    return _cache_png({"v": OVERLAY_LAYOUT_VERSION, "layers": [caption_png.name, cta_png.name]},
+                      draw)
+
+
+# ── Base segment cache ───────────────────────────────────────────────────────
+# The first render of a (source, start, duration, style) also writes the
+# caption-free, scaled+padded base segment to BASE_CACHE_DIR in the same ffmpeg
+# pass. Later caption edits only composite a new overlay onto that base.
+# Bases are kept per profile scale: the Studio editor re-renders drafts, so a
+# draft-resolution base is what its caption edits reuse.
+
+# Near-lossless so a caption re-render doesn't visibly lose a generation
+BASE_ENCODE = ["-c:v", "libx264", "-crf", "12", "-preset", "veryfast",
+               "-c:a", "aac", "-b:a", "128k"]
+FINAL_ENCODE = ["-c:v", "libx264", "-crf", "20", "-preset", "fast"]
+
+# Named encode profiles for composited renders. Drafts are for review only
+# (most get rejected); approving one re-renders the same job at "final".
+# A draft's base is encoded at draft scale and ultrafast, so filling it costs a
+# fraction of the full-quality CRF-12 base.
+PROFILES = {
+    "draft":   {"scale": (OW // 2, OH // 2),
+                "encode": ["-c:v", "libx264", "-crf", "28", "-preset", "ultrafast"],
+                "base_encode": ["-c:v", "libx264", "-crf", "18", "-preset", "ultrafast",
+                                "-c:a", "aac", "-b:a", "128k"]},
+    "final":   {"scale": None, "encode": FINAL_ENCODE, "base_encode": BASE_ENCODE},
+    "archive": {"scale": None, "base_encode": BASE_ENCODE,
+                "encode": ["-c:v", "libx264", "-crf", "18", "-preset", "slow"]},
+}
+
+
+def profile_filters(base_filters: list[str], profile: str) -> list[str]:
+    """base_filters, then a downscale to the profile's size (before the caption overlay)."""
+    size = PROFILES[profile]["scale"]
+    return base_filters + [f"scale={size[0]}:{size[1]}"] if size else base_filters
+
+
+def _base_path(source: Path, start: float, duration: float, base_filters: list[str],
+               profile: str = "final") -> Path:
+    sig = media_index.identity(source)
+    key_data = {"source": sig, "start": round(start, 3), "duration": round(duration, 3),
+                "filters": profile_filters(base_filters, profile),
+                "encode": PROFILES[profile]["base_encode"]}
+    key = hashlib.sha256(json.dumps(key_data, sort_keys=True).encode()).hexdigest()[:32]
+    return BASE_CACHE_DIR / f"{key}.mp4"
+
+
+@contextmanager
+def encoder_threads(n: int):
+    """
+    ["-threads", t] for each of the n encoders in one multi-output pass. The
+    caller's render slot plus any idle slots (render_pool.spare) are split n
+    ways, so a pass with many outputs stays within the cores its slots stand for.
+    """
+    with render_pool.spare(n - 1) as extra:
+        yield ["-threads", str(max(1, FFMPEG_THREADS * (1 + extra) // n))]
+
+
+def _render_composited(source: Path, start: float, duration: float,
+                       base_filters: list[str], outputs: list[tuple[Path, Path]], what: str,
+                       profile: str = "final"):
+    """
+    Cut [start, start+duration) and apply base_filters once, then split the
+    result and overlay one caption PNG per (out, overlay_png) — a single decode
+    for any number of caption variants. Outputs and the base are both at the
+    profile's scale; a miss fills that profile's base.
+    """
+    encode = PROFILES[profile]["encode"]
+    size = PROFILES[profile]["scale"]
+    base = _base_path(source, start, duration, base_filters, profile)
+    hit = base.exists()
+    k = len(outputs)
+    n = k if hit else k + 1   # on a miss one extra branch feeds the base cache
+    head = "[0:v]" if hit else f"[0:v]{','.join(profile_filters(base_filters, profile))},"
+    graph = head + f"split={n}" + "".join(f"[s{i}]" for i in range(n))
+    for i in range(k):
+        # Captions are drawn at 1080x1920; scale them to the profile like the base
+        caption = f"[{i + 1}:v]"
+        if size:
+            graph += f";{caption}scale={size[0]}:{size[1]}[c{i}]"
+            caption = f"[c{i}]"
+        graph += f";[s{i}]{caption}overlay=0:0[v{i}]"
+    overlay_inputs = [a for _, png in outputs for a in ("-i", str(png))]
+    audio = ["-c:a", "copy"] if hit else ["-c:a", "aac", "-b:a", "128k"]
+    # -ss/-t are per-output options, so every output file gets its own trim
+    seek_in, seek_out = ([], []) if hit else seek_args(source, start)
+    trim = [*seek_out, "-t", str(duration)]
+    with encoder_threads(n) as threads:
+        final_outs = []
+        for i, (out, _) in enumerate(outputs):
+            final_outs += ["-map", f"[v{i}]", "-map", "0:a", *trim, *audio, *encode,
+                           *threads, "-movflags", "+faststart", str(out)]
+
+        if hit:
+            os.utime(base)  # LRU touch
+            cmd = ["ffmpeg", "-y", "-i", str(base), *overlay_inputs,
+                   "-filter_complex", graph, *final_outs]
+            tmp_base = None
+        else:
+            BASE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            tmp_base = base.with_name(f"{base.stem}.{threading.get_ident()}.part.mp4")
+            cmd = ["ffmpeg", "-y", *seek_in, "-i", str(source), *overlay_inputs,
+                   "-filter_complex", graph, *final_outs,
+                   "-map", f"[s{k}]", "-map", "0:a", *trim, *PROFILES[profile]["base_encode"],
+                   *threads, str(tmp_base)]
+        try:
+            r = _run_ffmpeg(cmd, outputs[0][0], duration=duration)
+            if r.returncode != 0:
+                raise RuntimeError(f"{what} render failed: {r.stderr[-300:]}")
+            if tmp_base:
+                os.replace(tmp_base, base)
+        except BaseException:
+            for out, _ in outputs:
+                out.unlink(missing_ok=True)
+            raise
+        finally:
+            if tmp_base:
+                tmp_base.unlink(missing_ok=True)
+    if tmp_base:
+        file_cache.evict_lru(BASE_CACHE_DIR, BASE_CACHE_MAX_MB)
+
+
+MEME_BASE_FILTERS = [
+    f"scale={OW}:-2",
+    f"pad={OW}:{OH}:(ow-iw)/2:(oh-ih)/2:black",
+]
+
+QUOTE_BASE_FILTERS = [
+    f"scale={OW}:{OH}:force_original_aspect_ratio=increase",
+    f"crop={OW}:{OH}",
+    # dark overlay
+    f"drawbox=x=0:y=0:w={OW}:h={OH}:color=black@0.55:t=fill",
+]
 
-def _render_ad_image(image_path: Path, out: Path, duration: int = 5):
-    """Convert static image to video segment."""
-    r = subprocess.run([
-        "ffmpeg", "-y", "-loop", "1", "-i", str(image_path),
-        "-t", str(duration), "-vf", f"scale={OW}:{OH}:force_original_aspect_ratio=increase,crop={OW}:{OH}",
-        "-c:v", "libx264", "-crf", "20", "-preset", "fast",
-        "-an", "-movflags", "+faststart", str(out),
-    ], capture_output=True, text=True)
-    if r.returncode != 0:
-        raise RuntimeError(f"Ad image render failed: {r.stderr[-300:]}")
 
+def _render_meme(source: Path, out: Path, start: float, duration: float,
+                 caption: str, add_cta: bool = False):
+    render_variants(source, start, duration, [(out, caption)], "meme", add_cta)
 
-def _normalize_clip(src: Path, out: Path):
-    """Normalize any clip to 1080x1920 for concat."""
-    r = subprocess.run([
-        "ffmpeg", "-y", "-i", str(src),
-        "-vf", f"scale={OW}:{OH}:force_original_aspect_ratio=increase,crop={OW}:{OH},setsar=1",
-        "-c:v", "libx264", "-crf", "20", "-preset", "fast",
-        "-c:a", "aac", "-b:a", "128k", str(out),
-    ], capture_output=True, text=True)
-    if r.returncode != 0:
-        raise RuntimeError(f"Normalize failed: {r.stderr[-300:]}")
+
+def _render_quote(source: Path, out: Path, start: float, duration: float,
+                  quote: str, add_cta: bool = False):
+    render_variants(source, start, duration, [(out, quote)], "quote", add_cta)
+
+
+_STYLES = {
+    "meme":  ("Meme", MEME_BASE_FILTERS, _meme_caption_items, _meme_cta_items),
+    "quote": ("Quote", QUOTE_BASE_FILTERS, _quote_caption_items, _quote_cta_items),
+}
+
+
+def render_variants(source: Path, start: float, duration: float,
+                    variants: list[tuple[Path, str]], style: str = "meme",
+                    add_cta: bool = False, profile: str = "final") -> list[Path]:
+    """
+    Render one clip range with several captions, given as (out, caption) pairs,
+    from a single ffmpeg process: one decode, one encode per variant.
+    """
+    what, base_filters, caption_items, cta_items = _STYLES[style]
+    rng = media_index.clamp_range(source, start, duration)
+    if rng is None:
+        raise RuntimeError(f"{what} start {start:.1f}s is past the end of {Path(source).name}")
+    start, duration = rng
+    cta = cta_items() if add_cta else None
+    outputs = [(out, caption_overlay(caption_items(caption), cta)) for out, caption in variants]
+    for out, _ in outputs:
+        # An existing output may be a hard link into render_cache; writing through
+        # it (O_TRUNC) would overwrite the cache entry for the old render
+        out.unlink(missing_ok=True)
+    render_backend.get_backend().composite(source, start, duration, base_filters, outputs,
+                                           what, profile)
+    return [out for out, _ in variants]
+
+
+# ── Compilations ─────────────────────────────────────────────────────────────
+# Every clip and ad is normalized once into SEGMENT_CACHE_DIR with identical
+# stream parameters (size, fps, pix_fmt, timebase, audio layout), keyed by the
+# input's content hash. Segments that share parameters concatenate with -c copy,
+# so a compilation only encodes segments it hasn't seen before.
+
+SEGMENT_VERSION = 1
+SEGMENT_FPS = 30
+SEGMENT_VIDEO = ["-c:v", "libx264", "-crf", "20", "-preset", "fast", "-pix_fmt", "yuv420p",
+                 "-video_track_timescale", "15360"]
+SEGMENT_AUDIO = ["-c:a", "aac", "-b:a", "128k", "-ar", "48000", "-ac", "2"]
+SEGMENT_ENCODE = SEGMENT_VIDEO + SEGMENT_AUDIO
+SEGMENT_VF = (f"scale={OW}:{OH}:force_original_aspect_ratio=increase,crop={OW}:{OH},"
+              f"setsar=1,fps={SEGMENT_FPS}")
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def _segment(src: Path, image_duration: int) -> Path:
+    """Cached concat-ready normalization of a clip, video ad or image ad."""
+    is_image = src.suffix.lower() in IMAGE_EXTS
+    digest = media_index.content_hash(src)
+    if digest is None:
+        raise RuntimeError(f"Segment source not found: {src}")
+    key_data = {"v": SEGMENT_VERSION, "sha256": digest, "vf": SEGMENT_VF,
+                "encode": SEGMENT_ENCODE, "image_duration": image_duration if is_image else None}
+    key = hashlib.sha256(json.dumps(key_data, sort_keys=True).encode()).hexdigest()[:32]
+    seg = SEGMENT_CACHE_DIR / f"{key}.mp4"
+    if seg.exists():
+        os.utime(seg)  # LRU touch
+        return seg
+
+    # Stills and silent clips get a silent track so every segment has the same streams
+    silence = ["-f", "lavfi", "-i", "anullsrc=r=48000:cl=stereo"]
+    if is_image:
+        inputs = ["-loop", "1", "-t", str(image_duration), "-i", str(src), *silence]
+        audio, duration = "1:a", image_duration
+    else:
+        inputs = ["-i", str(src)]
+        audio, duration = "0:a:0", None
+        if not media_index.has_audio(src):
+            inputs += silence
+            audio = "1:a"
+    SEGMENT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = seg.with_name(f"{key}.{threading.get_ident()}.part.mp4")
+    bounds = [] if is_image else chunk_bounds(src)
+    try:
+        if len(bounds) > 1:
+            encode_chunked(src, tmp, bounds, audio_silent=(audio == "1:a"))
+        else:
+            r = _run_ffmpeg([
+                "ffmpeg", "-y", *inputs, "-map", "0:v:0", "-map", audio, "-vf", SEGMENT_VF,
+                *SEGMENT_ENCODE, "-threads", str(FFMPEG_THREADS), "-shortest", str(tmp),
+            ], tmp, duration=duration)
+            if r.returncode != 0:
+                raise RuntimeError(f"Normalize failed for {src.name}: {r.stderr[-300:]}")
+        os.replace(tmp, seg)
+    finally:
+        tmp.unlink(missing_ok=True)
+    file_cache.evict_lru(SEGMENT_CACHE_DIR, SEGMENT_CACHE_MAX_MB)
+    return seg
+
+
+def _concat_line(path: Path) -> str:
+    return "file '" + str(path).replace("'", "'\\''") + "'"
+
+
+# ── Chunked encoding ─────────────────────────────────────────────────────────
+# One x264 process doesn't scale across many cores, so long segments are cut
+# at source keyframes into ~CHUNK_SECONDS pieces whose video is encoded by
+# parallel ffmpeg processes. Each chunk starts on a keyframe and ends where the
+# next one starts, so the chunks join with a stream-copy concat; audio is
+# encoded once for the whole timeline and muxed in, avoiding AAC priming gaps.
+
+def chunk_bounds(source: Path, chunk_seconds: float | None = None) -> list[float]:
+    """Chunk start times: 0, then the first keyframe >= chunk_seconds after the last."""
+    chunk_seconds = CHUNK_SECONDS if chunk_seconds is None else chunk_seconds
+    if chunk_seconds <= 0:
+        return []
+    bounds = [0.0]
+    for t in media_index.keyframes(source) or []:
+        if t - bounds[-1] >= chunk_seconds:
+            bounds.append(t)
+    return bounds
+
+
+def chunk_workers() -> int:
+    """Most encoders one chunked encode runs at once (before render slots are checked)."""
+    return CHUNK_WORKERS or render_pool.capacity()
+
+
+def encode_chunked(source: Path, out: Path, bounds: list[float], audio_silent: bool = False,
+                   workers: int | None = None, vf: str = SEGMENT_VF):
+    """
+    Encode `source` to the segment format in parallel chunks starting at `bounds`.
+
+    The caller's own render slot covers one encoder; the rest run on slots that
+    are idle right now (render_pool.spare), so chunking never pushes queue and
+    pipeline renders past capacity. With no spare slots the chunks run serially.
+    """
+    threads = str(FFMPEG_THREADS)
+    job_id = getattr(_local, "job_id", None)
+    meters = metrics.current()
+    work = out.with_name(f".{out.stem}.{threading.get_ident()}.chunks")
+    work.mkdir(parents=True, exist_ok=True)
+
+    def run(cmd: list[str], target: Path, what: str):
+        # Pool threads don't inherit tracking() or meters; re-register so cancel()
+        # still kills them and their usage is charged to the caller's stage
+        with tracking(job_id) if job_id else nullcontext(), metrics.attach(meters):
+            r = _run_ffmpeg(cmd, target)
+        if r.returncode != 0:
+            raise RuntimeError(f"{what} failed: {r.stderr[-300:]}")
+
+    tasks = []
+    chunks = []
+    for i, start in enumerate(bounds):
+        end = bounds[i + 1] if i + 1 < len(bounds) else None
+        chunk = work / f"{i:04d}.mp4"
+        chunks.append(chunk)
+        tasks.append(([
+            "ffmpeg", "-y", *(["-ss", f"{start:.3f}"] if start else []),
+            *(["-t", f"{end - start:.3f}"] if end is not None else []),
+            "-i", str(source), "-map", "0:v:0", "-an", "-vf", vf, *SEGMENT_VIDEO,
+            "-threads", threads, str(chunk),
+        ], chunk, f"Chunk {i} encode"))
+    audio_file = work / "audio.m4a"
+    if not audio_silent:
+        tasks.append((["ffmpeg", "-y", "-i", str(source), "-map", "0:a:0", "-vn",
+                       *SEGMENT_AUDIO, str(audio_file)], audio_file, "Audio encode"))
+    try:
+        wanted = min(workers or chunk_workers(), len(tasks))
+        with render_pool.spare(wanted - 1) as extra, \
+                ThreadPoolExecutor(max_workers=1 + extra) as pool:
+            for f in [pool.submit(run, *t) for t in tasks]:
+                f.result()
+        concat_list = work / "chunks.txt"
+        concat_list.write_text("\n".join(_concat_line(c) for c in chunks))
+        audio_in = (["-f", "lavfi", "-i", "anullsrc=r=48000:cl=stereo"] if audio_silent
+                    else ["-i", str(audio_file)])
+        run(["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", str(concat_list), *audio_in,
+             "-map", "0:v:0", "-map", "1:a:0", "-c:v", "copy",
+             *(SEGMENT_AUDIO if audio_silent else ["-c:a", "copy"]),
+             "-video_track_timescale", "15360", "-shortest", str(out)], out, "Chunk join")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
 
 
 def concat_with_ad(clip_paths: list[Path], ad_path: Path, out: Path,
                    placement: str = "end", frequency: int = 2,
                    image_duration: int = 5):
     """Concatenate clips with ad insertion."""
-    tmp_dir = out.parent / "tmp_concat"
-    tmp_dir.mkdir(exist_ok=True)
-
-    # Prepare ad segment
-    ad_ext = ad_path.suffix.lower()
-    ad_video = tmp_dir / "ad_norm.mp4"
-    if ad_ext in (".jpg", ".jpeg", ".png", ".webp"):
-        _render_ad_image(ad_path, ad_video, duration=image_duration)
-    else:
-        _normalize_clip(ad_path, ad_video)
+    ad_video = _segment(ad_path, image_duration)
 
     # Build sequence
     sequence = []
     for i, clip in enumerate(clip_paths):
-        norm = tmp_dir / f"clip_{i:03d}.mp4"
-        _normalize_clip(clip, norm)
-        sequence.append(norm)
+        sequence.append(_segment(clip, image_duration))
         if placement in ("between", "both") and (i + 1) % frequency == 0 and i < len(clip_paths) - 1:
             sequence.append(ad_video)
 
     if placement in ("end", "both"):
         sequence.append(ad_video)
 
-    # Write concat list
-    concat_list = tmp_dir / "concat.txt"
-    concat_list.write_text("\n".join(f"file '{p}'" for p in sequence))
-
-    r = subprocess.run([
-        "ffmpeg", "-y", "-f", "concat", "-safe", "0",
-        "-i", str(concat_list),
-        "-c:v", "libx264", "-crf", "20", "-preset", "fast",
-        "-c:a", "aac", "-b:a", "128k", "-movflags", "+faststart", str(out),
-    ], capture_output=True, text=True)
+    concat_list = out.with_name(f".{out.stem}.{threading.get_ident()}.concat.txt")
+    concat_list.write_text("\n".join(_concat_line(p) for p in sequence))
+    try:
+        r = _run_ffmpeg([
+            "ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", str(concat_list),
+            "-c", "copy", "-movflags", "+faststart", str(out),
+        ], out)
+    finally:
+        concat_list.unlink(missing_ok=True)
     if r.returncode != 0:
         raise RuntimeError(f"Concat failed: {r.stderr[-300:]}")
 
 
-def render_clip(source: Path, out_dir: Path, index: int, clip: dict,
-                add_cta: bool = False) -> Path:
-    """Render a single clip candidate. Returns output path."""
-    clip_type = clip.get("type", "meme")
+def _clip_spec(out_dir: Path, index: int, clip: dict) -> dict:
+    style = "meme" if clip.get("type", "meme") == "meme" else "quote"
     start = float(clip.get("timestamp", 0))
-    duration = float(clip.get("duration", 15))
+    return {
+        "index": index,
+        "style": style,
+        "start": start,
+        "duration": float(clip.get("duration", 15)),
+        "text": clip.get("caption" if style == "meme" else "quote", ""),
+        "out": out_dir / f"{index:02d}_{style}_{int(start)}s.mp4",
+    }
 
-    if clip_type == "meme":
-        caption = clip.get("caption", "")
-        name = f"{index:02d}_meme_{int(start)}s.mp4"
-        out = out_dir / name
-        _render_meme(source, out, start, duration, caption, add_cta=add_cta)
-    else:
-        quote = clip.get("quote", "")
-        name = f"{index:02d}_quote_{int(start)}s.mp4"
-        out = out_dir / name
-        _render_quote(source, out, start, duration, quote, add_cta=add_cta)
 
-    return out
+def render_clip(source: Path, out_dir: Path, index: int, clip: dict,
+                add_cta: bool = False) -> Path:
+    """Render a single clip candidate. Returns output path."""
+    spec = _clip_spec(out_dir, index, clip)
+    render_variants(source, spec["start"], spec["duration"], [(spec["out"], spec["text"])],
+                    spec["style"], add_cta=add_cta)
+    return spec["out"]
+
+
+# ── Batch rendering ──────────────────────────────────────────────────────────
+# All candidates from one source, sorted by timestamp, are cut in a few
+# sequential passes: one ffmpeg per group seeks once, decodes the group's span
+# and trims/filters/encodes every clip in it from the same decoded frames.
+
+BATCH_MAX_OUTPUTS = 6      # encoders per ffmpeg process
+BATCH_MAX_GAP = 30.0       # seconds of unused source worth decoding to stay in one pass
+
+
+def _batch_groups(specs: list[dict]) -> list[list[dict]]:
+    groups: list[list[dict]] = []
+    end = 0.0
+    for spec in sorted(specs, key=lambda s: s["start"]):
+        if (not groups or len(groups[-1]) >= BATCH_MAX_OUTPUTS
+                or spec["start"] - end > BATCH_MAX_GAP):
+            groups.append([])
+            end = 0.0
+        groups[-1].append(spec)
+        end = max(end, spec["start"] + spec["duration"])
+    return groups
+
+
+def _render_group(source: Path, group: list[dict], add_cta: bool):
+    """One ffmpeg pass over [first start, last end) producing every clip in `group`."""
+    first = group[0]["start"]
+    origin = media_index.keyframe_before(source, first)
+    if origin is None:
+        origin = first  # no index: ffmpeg's accurate input seek lands exactly on `first`
+    span = max(s["start"] + s["duration"] for s in group) - origin
+    k = len(group)
+
+    overlay_inputs, chains, outputs = [], [], []
+    for i, spec in enumerate(group):
+        what, base_filters, caption_items, cta_items = _STYLES[spec["style"]]
+        png = caption_overlay(caption_items(spec["text"]), cta_items() if add_cta else None)
+        overlay_inputs += ["-i", str(png)]
+        at = f"start={spec['start'] - origin:.3f}:duration={spec['duration']:.3f}"
+        chains.append(f"[i{i}]trim={at},setpts=PTS-STARTPTS,{','.join(base_filters)}[b{i}];"
+                      f"[b{i}][{i + 1}:v]overlay=0:0[v{i}];"
+                      f"[j{i}]atrim={at},asetpts=PTS-STARTPTS[a{i}]")
+        outputs.append(["-map", f"[v{i}]", "-map", f"[a{i}]", "-c:a", "aac", "-b:a", "128k",
+                        *FINAL_ENCODE])
+    graph = (f"[0:v]split={k}" + "".join(f"[i{i}]" for i in range(k)) + ";"
+             f"[0:a]asplit={k}" + "".join(f"[j{i}]" for i in range(k)) + ";"
+             + ";".join(chains))
+    seek_in = ["-ss", f"{origin:.3f}"] if origin > 0 else []
+    try:
+        with encoder_threads(k) as threads:
+            outs = [a for spec, args in zip(group, outputs)
+                    for a in (*args, *threads, "-movflags", "+faststart", str(spec["out"]))]
+            r = _run_ffmpeg([
+                "ffmpeg", "-y", *seek_in, "-t", f"{span:.3f}", "-i", str(source),
+                *overlay_inputs, "-filter_complex", graph, *outs,
+            ], group[0]["out"], duration=max(s["duration"] for s in group))
+        if r.returncode != 0:
+            raise RuntimeError(f"Batch render failed: {r.stderr[-300:]}")
+    except BaseException:
+        for spec in group:
+            spec["out"].unlink(missing_ok=True)
+        raise
+
+
+def plan_batch(source: Path, out_dir: Path, clips: list[dict],
+               first_index: int = 1) -> tuple[list[list[dict]], list]:
+    """
+    Split candidates from `source` (named as render_clip would, index =
+    first_index + position) into render groups. Returns (groups, [(index, error)])
+    where the errors are clips whose range lies past the end of the source.
+    """
+    specs, errors = [], []
+    for i, clip in enumerate(clips):
+        spec = _clip_spec(out_dir, first_index + i, clip)
+        rng = media_index.clamp_range(source, spec["start"], spec["duration"])
+        if rng is None:
+            errors.append((spec["index"], RuntimeError(f"Clip starts past the end of {source.name}")))
+            continue
+        spec["start"], spec["duration"] = rng
+        spec["clip"] = clip
+        specs.append(spec)
+    return _batch_groups(specs), errors
+
+
+def render_group(source: Path, group: list[dict], add_cta: bool = False) -> list[tuple]:
+    """
+    Render one plan_batch group with the configured backend.
+    Returns [(index, Path | Exception)].
+    """
+    return render_backend.get_backend().render_group(source, group, add_cta)
+
+
+def _render_group_pass(source: Path, group: list[dict], add_cta: bool) -> list[tuple]:
+    """
+    render_group for the ffmpeg backend: one pass for the whole group; a failed
+    group is retried clip by clip so one bad clip doesn't sink its neighbours.
+    """
+    try:
+        _render_group(source, group, add_cta)
+        return [(spec["index"], spec["out"]) for spec in group]
+    except RenderCancelled:
+        raise
+    except Exception as e:
+        if len(group) == 1:
+            return [(group[0]["index"], e)]
+    results = []
+    for spec in group:
+        try:
+            results.append((spec["index"], render_clip(source, spec["out"].parent,
+                                                       spec["index"], spec["clip"], add_cta)))
+        except RenderCancelled:
+            raise
+        except Exception as e:
+            results.append((spec["index"], e))
+    return results
+
+
+def render_batch(source: Path, out_dir: Path, clips: list[dict], add_cta: bool = False):
+    """Render all candidates group by group, yielding (index, Path | Exception)."""
+    groups, errors = plan_batch(source, out_dir, clips)
+    yield from errors
+    for group in groups:
+        yield from render_group(source, group, add_cta)
+
+
+# Job modes render_job can render; the API rejects the rest at submit time
+QUEUE_MODES = ("meme",)
+
+
+def render_job(job: dict, out_dir: Path) -> list[Path]:
+    """
+    Render a Studio queue job (see queue.build_job). Returns the output paths —
+    one per caption variant, or just <output_name>.mp4 for a plain job.
+    """
+    mode = job.get("mode", "meme")
+    if mode not in QUEUE_MODES:
+        raise RuntimeError(f"Render mode not supported by the queue worker: {mode}")
+    variants = job.get("variants") or [{"caption": job.get("hook_caption", ""),
+                                        "output_name": job["output_name"]}]
+    return render_variants(
+        Path(job["source_file"]), float(job["start_sec"]), float(job["duration_sec"]),
+        [(out_dir / f"{v['output_name']}.mp4", v["caption"]) for v in variants],
+        "meme", add_cta=True, profile=job.get("profile") or "final")
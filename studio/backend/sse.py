@@ -16,12 +16,7 @@ def _make_event(event: str, data: dict) -> str:
     return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 
-def emit(job_id: str, event: str, data: dict):
-    """
-    Called from sync background threads (pipeline, queue processor).
-    Pushes to all SSE subscribers for this job + global subscribers.
-    """
-    msg = _make_event(event, {"job_id": job_id, **data})
+def _broadcast(job_id: str | None, msg: str):
     for q in list(_subscribers.get(job_id, [])):
         try:
             q.put_nowait(msg)
@@ -34,6 +29,19 @@ def emit(job_id: str, event: str, data: dict):
             pass
 
 
+def emit(job_id: str, event: str, data: dict):
+    """
+    Called from sync background threads (pipeline, queue processor).
+    Pushes to all SSE subscribers for this job + global subscribers.
+    """
+    _broadcast(job_id, _make_event(event, {"job_id": job_id, **data}))
+
+
+def publish(data: dict):
+    """Push an unnamed event — the kind EventSource.onmessage receives."""
+    _broadcast(data.get("job_id"), f"data: {json.dumps(data)}\n\n")
+
+
 async def subscribe_all() -> AsyncIterator[str]:
     """Async generator — yields SSE messages for all jobs."""
     q: asyncio.Queue = asyncio.Queue(maxsize=100)
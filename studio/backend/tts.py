@@ -1,9 +1,8 @@
-import json
-import subprocess
 import uuid
 from pathlib import Path
 import httpx
 from .config import ELEVENLABS_API_KEY, OPENAI_API_KEY, TMP_DIR
+from . import media_index
 
 OPENAI_VOICES = {"alloy", "echo", "fable", "onyx", "nova", "shimmer"}
 
@@ -16,16 +15,9 @@ ELEVENLABS_VOICE_IDS = {
 
 
 def get_audio_duration(filepath: str) -> float:
-    result = subprocess.run(
-        ["ffprobe", "-v", "quiet", "-print_format", "json", "-show_streams", filepath],
-        capture_output=True,
-        text=True,
-    )
-    data = json.loads(result.stdout)
-    for stream in data.get("streams", []):
-        if "duration" in stream:
-            return float(stream["duration"])
-    return 10.0
+    # TTS output is a temp file: probe it without adding it to the index
+    duration = media_index.duration(filepath, persist=False)
+    return duration if duration is not None else 10.0
 
 
 async def _tts_openai(script: str, voice: str, out_path: Path) -> Path:
@@ -2,50 +2,156 @@
 whisper.py — Audio extraction + OpenAI Whisper transcription
 """
 import json
+import math
 import os
-import subprocess
 from pathlib import Path
 
 import httpx
 
-from .config import PROCESSING_DIR, OPENAI_API_KEY
+from .config import PROCESSING_DIR, OPENAI_API_KEY, TRANSCRIBE_WINDOW_SECONDS
+from . import artifact_cache, media_index, metrics
+
+WHISPER_MODEL = "whisper-1"
+AUDIO_ARGS = ["-vn", "-ar", "16000", "-ac", "1", "-b:a", "32k"]
 
 
 def extract_audio(video_path: Path, job_id: str) -> Path:
-    """Extract mono 16kHz audio from video using ffmpeg."""
+    """Extract mono 16kHz audio from video using ffmpeg (reused across jobs by content hash)."""
     audio_path = PROCESSING_DIR / f"{job_id}_audio.mp3"
-    result = subprocess.run([
-        "ffmpeg", "-y", "-i", str(video_path),
-        "-vn", "-ar", "16000", "-ac", "1", "-b:a", "32k",
+    key = artifact_cache.key("audio", media_index.content_hash(video_path), args=AUDIO_ARGS)
+    if artifact_cache.restore(key, audio_path):
+        return audio_path
+    audio_path.unlink(missing_ok=True)  # may be a link into the cache
+    result = metrics.run([
+        "ffmpeg", "-y", "-i", str(video_path), *AUDIO_ARGS,
         str(audio_path)
-    ], capture_output=True, text=True)
+    ])
     if result.returncode != 0:
         raise RuntimeError(f"Audio extraction failed: {result.stderr[-500:]}")
+    artifact_cache.store(key, audio_path)
     return audio_path
 
 
+def _whisper(audio_path: Path) -> dict:
+    if not OPENAI_API_KEY:
+        raise RuntimeError("OPENAI_API_KEY not set")
+
+    with open(audio_path, "rb") as f:
+        audio_bytes = f.read()
+
+    with metrics.api("whisper"):
+        response = httpx.post(
+            "https://api.openai.com/v1/audio/transcriptions",
+            headers={"Authorization": f"Bearer {OPENAI_API_KEY}"},
+            data={"model": WHISPER_MODEL, "response_format": "verbose_json"},
+            files={"file": (audio_path.name, audio_bytes, "audio/mpeg")},
+            timeout=120,
+        )
+    response.raise_for_status()
+    return response.json()
+
+
 def transcribe(audio_path: Path, job_id: str) -> dict:
     """Transcribe audio via OpenAI Whisper API. Returns verbose_json with segments."""
+    transcript = None
+    for _, _, transcript in transcribe_windows(audio_path, job_id):
+        pass
+    return transcript
+
+
+def _shift(data: dict, offset: float) -> dict:
+    segments = []
+    for seg in data.get("segments", []):
+        seg = dict(seg)
+        seg["start"] = seg.get("start", 0) + offset
+        seg["end"] = seg.get("end", 0) + offset
+        segments.append(seg)
+    return {**data, "segments": segments}
+
+
+def window_count(audio_path: Path, window: float = TRANSCRIBE_WINDOW_SECONDS) -> int:
+    """How many windows transcribe_windows will split `audio_path` into."""
+    total = media_index.duration(audio_path)
+    if not total or window <= 0 or total <= window * 1.2:
+        return 1
+    return math.ceil(total / window)
+
+
+def _windows(data: dict, window: float, count: int):
+    """Re-split a merged transcript into the windows it was transcribed in."""
+    if count == 1:
+        yield 0, data, data
+        return
+    parts = [[] for _ in range(count)]
+    for seg in data.get("segments", []):
+        parts[min(int(seg.get("start", 0) // window), count - 1)].append(seg)
+    for i, segments in enumerate(parts):
+        part = {"text": " ".join(s.get("text", "").strip() for s in segments),
+                "segments": segments}
+        yield i, part, data
+
+
+def _write(path: Path, data: dict):
+    path.unlink(missing_ok=True)  # may be a link into the cache
+    path.write_text(json.dumps(data, indent=2))
+
+
+def transcribe_windows(audio_path: Path, job_id: str,
+                       window: float = TRANSCRIBE_WINDOW_SECONDS):
+    """
+    Transcribe in TRANSCRIBE_WINDOW_SECONDS windows, yielding
+    (window_index, window_transcript, full_transcript_so_far) as each one lands.
+    Segment times are absolute. Short audio is a single window; the merged
+    transcript is cached at <job_id>_transcript.json as before, and across
+    jobs by the audio's content hash.
+    """
     transcript_path = PROCESSING_DIR / f"{job_id}_transcript.json"
+    count = window_count(audio_path, window)
+    audio_hash = media_index.content_hash(audio_path)
+    key = artifact_cache.key("transcript", audio_hash, model=WHISPER_MODEL,
+                             window=window if count > 1 else None)
 
     # Return cached if exists
-    if transcript_path.exists():
-        return json.loads(transcript_path.read_text())
+    if transcript_path.exists() or artifact_cache.restore(key, transcript_path):
+        yield from _windows(json.loads(transcript_path.read_text()), window, count)
+        return
 
-    if not OPENAI_API_KEY:
-        raise RuntimeError("OPENAI_API_KEY not set")
+    total = media_index.duration(audio_path)
+    if count == 1:
+        data = _whisper(audio_path)
+        _write(transcript_path, data)
+        artifact_cache.store(key, transcript_path)
+        yield 0, data, data
+        return
 
-    with open(audio_path, "rb") as f:
-        audio_bytes = f.read()
+    merged = {"text": "", "segments": [], "windows": 0}
+    offset, i = 0.0, 0
+    while offset < total:
+        part_path = PROCESSING_DIR / f"{job_id}_transcript_{i:03d}.json"
+        part_key = artifact_cache.key("transcript_window", audio_hash, model=WHISPER_MODEL,
+                                      window=window, index=i)
+        if part_path.exists() or artifact_cache.restore(part_key, part_path):
+            part = json.loads(part_path.read_text())
+        else:
+            audio_part = PROCESSING_DIR / f"{job_id}_audio_{i:03d}.mp3"
+            result = metrics.run([
+                "ffmpeg", "-y", "-ss", f"{offset:.3f}", "-t", f"{window:.3f}",
+                "-i", str(audio_path), "-c", "copy", str(audio_part),
+            ])
+            if result.returncode != 0:
+                raise RuntimeError(f"Audio split failed: {result.stderr[-500:]}")
+            part = _shift(_whisper(audio_part), offset)
+            audio_part.unlink(missing_ok=True)
+            _write(part_path, part)
+            artifact_cache.store(part_key, part_path)
+        merged["text"] = f"{merged['text']} {part.get('text', '')}".strip()
+        merged["segments"].extend(part.get("segments", []))
+        merged["windows"] = i + 1
+        yield i, part, merged
+        offset += window
+        i += 1
 
-    response = httpx.post(
-        "https://api.openai.com/v1/audio/transcriptions",
-        headers={"Authorization": f"Bearer {OPENAI_API_KEY}"},
-        data={"model": "whisper-1", "response_format": "verbose_json"},
-        files={"file": (audio_path.name, audio_bytes, "audio/mpeg")},
-        timeout=120,
-    )
-    response.raise_for_status()
-    data = response.json()
-    transcript_path.write_text(json.dumps(data, indent=2))
-    return data
+    _write(transcript_path, merged)
+    artifact_cache.store(key, transcript_path)
+    for j in range(i):
+        (PROCESSING_DIR / f"{job_id}_transcript_{j:03d}.json").unlink(missing_ok=True)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+bench/batch.py — Per-clip renders vs grouped render_batch.
+
+    python3 bench/batch.py uploads/episode.mp4 --clips 8 --duration 12
+
+Spreads --clips candidates evenly over the first --span seconds of the source
+(alternating meme/quote) and renders them both ways into a temp dir.
+"per-clip" is the single-encode command render_clip ran before batching: one
+ffmpeg per clip, no base-cache output (render_clip now also writes a CRF-12
+base on a miss, which would inflate the speedup). Caption overlays are drawn
+before either side is timed.
+"""
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from backend import media_index, renderer  # noqa: E402
+
+
+def _candidates(count: int, span: float, duration: float) -> list[dict]:
+    step = max(span - duration, 0) / max(count - 1, 1)
+    clips = []
+    for i in range(count):
+        clip = {"type": "meme" if i % 2 == 0 else "quote",
+                "timestamp": round(i * step, 2), "duration": duration}
+        clip["caption" if clip["type"] == "meme" else "quote"] = f"Bench clip {i + 1}"
+        clips.append(clip)
+    return clips
+
+
+def _single(source: Path, spec: dict):
+    _, base_filters, caption_items, _ = renderer._STYLES[spec["style"]]
+    png = renderer.caption_overlay(caption_items(spec["text"]))
+    seek_in, seek_out = renderer.seek_args(source, spec["start"])
+    r = subprocess.run([
+        "ffmpeg", "-y", *seek_in, "-i", str(source), "-i", str(png),
+        "-filter_complex", f"[0:v]{','.join(base_filters)}[b];[b][1:v]overlay=0:0[v]",
+        "-map", "[v]", "-map", "0:a", *seek_out, "-t", str(spec["duration"]),
+        "-c:a", "aac", "-b:a", "128k", *renderer.FINAL_ENCODE,
+        "-threads", str(renderer.FFMPEG_THREADS), "-movflags", "+faststart", str(spec["out"]),
+    ], capture_output=True, text=True)
+    if r.returncode != 0:
+        raise RuntimeError(r.stderr[-300:])
+
+
+def _timed(fn) -> float:
+    with tempfile.TemporaryDirectory() as bases:
+        renderer.BASE_CACHE_DIR = Path(bases)
+        t0 = time.perf_counter()
+        fn()
+        return time.perf_counter() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("source", type=Path)
+    ap.add_argument("--clips", type=int, default=8)
+    ap.add_argument("--duration", type=float, default=12.0)
+    ap.add_argument("--span", type=float, default=240.0,
+                    help="seconds of source the candidates are spread over")
+    args = ap.parse_args()
+
+    media_index.keyframes(args.source)  # warm the index so neither side pays for it
+    clips = _candidates(args.clips, args.span, args.duration)
+    specs = [renderer._clip_spec(Path("."), i + 1, c) for i, c in enumerate(clips)]
+    groups = renderer._batch_groups(specs)
+    for spec in specs:  # rasterise captions once; both sides reuse them
+        renderer.caption_overlay(renderer._STYLES[spec["style"]][2](spec["text"]))
+    print(f"{len(clips)} clips x {args.duration:.0f}s over {args.span:.0f}s "
+          f"-> {len(groups)} batch pass(es)")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        loop_dir, batch_dir = Path(tmp) / "loop", Path(tmp) / "batch"
+        loop_dir.mkdir()
+        batch_dir.mkdir()
+
+        def per_clip():
+            for i, clip in enumerate(clips):
+                _single(args.source, renderer._clip_spec(loop_dir, i + 1, clip))
+
+        def batched():
+            for i, result in renderer.render_batch(args.source, batch_dir, clips):
+                if isinstance(result, Exception):
+                    raise result
+
+        loop_s = _timed(per_clip)
+        batch_s = _timed(batched)
+
+    print(f"{'per-clip':>18} {loop_s:>8.2f}s")
+    print(f"{'render_batch':>18} {batch_s:>8.2f}s  ({loop_s / batch_s:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+bench/chunked.py — Wall-clock speedup of chunked segment encoding vs core count.
+
+    python3 bench/chunked.py uploads/episode.mp4 --chunk 20 --workers 1,2,4,8
+
+"single" is the one-process normalization concat_with_ad used before chunking;
+each worker count then runs renderer.encode_chunked over the same keyframe
+chunk bounds. Output is the segment format, so results are concat-compatible.
+Chunk encoders run on idle render slots, so worker counts above
+render_pool.capacity() need STUDIO_RENDER_WORKERS raised to take effect.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from backend import media_index, renderer  # noqa: E402
+
+
+def _single(source: Path, out: Path):
+    r = subprocess.run([
+        "ffmpeg", "-y", "-i", str(source), "-map", "0:v:0", "-map", "0:a:0",
+        "-vf", renderer.SEGMENT_VF, *renderer.SEGMENT_ENCODE, str(out),
+    ], capture_output=True, text=True)
+    if r.returncode != 0:
+        raise RuntimeError(r.stderr[-300:])
+
+
+def main():
+    cores = os.cpu_count() or 1
+    ap = argparse.ArgumentParser()
+    ap.add_argument("source", type=Path)
+    ap.add_argument("--chunk", type=float, default=renderer.CHUNK_SECONDS)
+    ap.add_argument("--workers", default=",".join(str(w) for w in (1, 2, 4, 8, 16) if w <= cores))
+    args = ap.parse_args()
+
+    media_index.keyframes(args.source)  # index once, outside the timings
+    bounds = renderer.chunk_bounds(args.source, args.chunk)
+    print(f"{cores} cores · {len(bounds)} chunks of ~{args.chunk:.0f}s")
+    silent = not media_index.has_audio(args.source)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        out = Path(tmp) / "seg.mp4"
+        t0 = time.perf_counter()
+        _single(args.source, out)
+        single = time.perf_counter() - t0
+        print(f"{'single':>10} {single:>8.2f}s")
+        for workers in (int(w) for w in args.workers.split(",")):
+            t0 = time.perf_counter()
+            renderer.encode_chunked(args.source, out, bounds, audio_silent=silent, workers=workers)
+            took = time.perf_counter() - t0
+            print(f"{workers:>7} w {took:>8.2f}s  ({single / took:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+bench/parity.py — Check the PyAV render backend against the ffmpeg one.
+
+    python3 bench/parity.py marketing_clips/siliconvalley1.mp4 --start 30 --duration 8
+
+Renders the same meme and quote clip with both backends (each with an empty
+base cache, so both decode the source) and compares the outputs: resolution,
+frame count, video/audio duration and PSNR over sampled frames. Also prints
+wall-clock time per backend. Exits 1 if any check fails. Needs PyAV.
+"""
+import argparse
+import math
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import ImageChops, ImageStat
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from backend import render_backend, renderer  # noqa: E402
+
+av = render_backend.av
+
+
+def _stats(path: Path) -> dict:
+    with av.open(str(path)) as c:
+        v = c.streams.video[0]
+        a = c.streams.audio[0] if c.streams.audio else None
+        frames = [f.to_image() for f in c.decode(v)]
+        audio_sec = None
+        if a is not None:
+            c.seek(0)
+            samples = sum(f.samples for f in c.decode(a))
+            audio_sec = samples / a.rate
+    return {"width": v.width, "height": v.height, "frames": frames,
+            "video_sec": len(frames) / float(v.average_rate), "audio_sec": audio_sec}
+
+
+def _psnr(a, b) -> float:
+    diff = ImageChops.difference(a.convert("RGB"), b.convert("RGB"))
+    mse = sum(v * v for v in ImageStat.Stat(diff).rms) / 3
+    return 99.0 if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+
+def _render(backend, source: Path, out: Path, start: float, duration: float,
+            style: str, profile: str) -> float:
+    what, base_filters, caption_items, cta_items = renderer._STYLES[style]
+    png = renderer.caption_overlay(caption_items("Parity check caption"), cta_items())
+    with tempfile.TemporaryDirectory() as bases:
+        renderer.BASE_CACHE_DIR = Path(bases)
+        t0 = time.perf_counter()
+        backend.composite(source, start, duration, base_filters, [(out, png)], what, profile)
+        return time.perf_counter() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("source", type=Path)
+    ap.add_argument("--start", type=float, default=30.0)
+    ap.add_argument("--duration", type=float, default=8.0)
+    ap.add_argument("--profile", default="final", choices=sorted(renderer.PROFILES))
+    ap.add_argument("--min-psnr", type=float, default=30.0)
+    ap.add_argument("--sample", type=int, default=10, help="compare every Nth frame")
+    args = ap.parse_args()
+    if av is None:
+        sys.exit("PyAV is not installed (pip install av)")
+
+    ffmpeg, pyav = render_backend.FfmpegBackend(), render_backend.PyAVBackend()
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        for style in ("meme", "quote"):
+            ref, cand = Path(tmp) / f"{style}_ffmpeg.mp4", Path(tmp) / f"{style}_pyav.mp4"
+            t_ref = _render(ffmpeg, args.source, ref, args.start, args.duration, style, args.profile)
+            t_cand = _render(pyav, args.source, cand, args.start, args.duration, style, args.profile)
+            r, c = _stats(ref), _stats(cand)
+            n = min(len(r["frames"]), len(c["frames"]))
+            psnr = min(_psnr(r["frames"][i], c["frames"][i]) for i in range(0, n, args.sample))
+            frame_sec = 1 / 30
+            checks = {
+                "resolution": (r["width"], r["height"]) == (c["width"], c["height"]),
+                "frames": abs(len(r["frames"]) - len(c["frames"])) <= 1,
+                "video_sec": abs(r["video_sec"] - c["video_sec"]) <= 2 * frame_sec,
+                "audio_sec": (r["audio_sec"] is None) == (c["audio_sec"] is None) and (
+                    r["audio_sec"] is None or abs(r["audio_sec"] - c["audio_sec"]) <= 0.1),
+                "psnr": psnr >= args.min_psnr,
+            }
+            failures += not all(checks.values())
+            print(f"{style}: ffmpeg {t_ref:.2f}s · pyav {t_cand:.2f}s · "
+                  f"frames {len(r['frames'])}/{len(c['frames'])} · min PSNR {psnr:.1f} dB")
+            for name, ok in checks.items():
+                print(f"  {'ok  ' if ok else 'FAIL'} {name}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+bench/seek.py — Render time vs clip start offset, old vs keyframe seeking.
+
+    python3 bench/seek.py marketing_clips/silicon_valley_1.mp4 --duration 10
+
+"legacy" is the pre-index command (-ss after -i: decodes from frame zero);
+"keyframe" is renderer.seek_args (input seek to the preceding keyframe,
+then trim < 1 GOP). Keyframe times should stay flat as the offset grows.
+"""
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from backend import media_index, renderer  # noqa: E402
+
+
+def _encode(source: Path, out: Path, pre: list[str], post: list[str], duration: float) -> float:
+    t0 = time.perf_counter()
+    r = subprocess.run([
+        "ffmpeg", "-y", *pre, "-i", str(source), *post, "-t", str(duration),
+        "-vf", f"scale={renderer.OW}:-2,pad={renderer.OW}:{renderer.OH}:(ow-iw)/2:(oh-ih)/2:black",
+        "-c:v", "libx264", "-crf", "20", "-preset", "fast", "-an", str(out),
+    ], capture_output=True, text=True)
+    if r.returncode != 0:
+        raise RuntimeError(r.stderr[-300:])
+    return time.perf_counter() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("source", type=Path)
+    ap.add_argument("--duration", type=float, default=10.0)
+    ap.add_argument("--offsets", default="0,60,300,600,1200")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    kfs = media_index.keyframes(args.source) or []
+    print(f"keyframe index: {len(kfs)} keyframes in {time.perf_counter() - t0:.2f}s (cached afterwards)")
+    print(f"{'offset':>8} {'legacy':>9} {'keyframe':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        out = Path(tmp) / "bench.mp4"
+        for offset in (float(o) for o in args.offsets.split(",")):
+            legacy = _encode(args.source, out, [], ["-ss", str(offset)], args.duration)
+            pre, post = renderer.seek_args(args.source, offset)
+            fast = _encode(args.source, out, pre, post, args.duration)
+            print(f"{offset:>7.0f}s {legacy:>8.2f}s {fast:>8.2f}s")
+
+
+if __name__ == "__main__":
+    main()
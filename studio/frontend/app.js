@@ -176,6 +176,9 @@ async function startPipeline() {
   eventSource.onmessage = (e) => {
     try { handlePipelineEvent(JSON.parse(e.data)); } catch (_) {}
   };
+  eventSource.addEventListener('progress', (e) => {
+    try { handleRenderProgress(JSON.parse(e.data)); } catch (_) {}
+  });
 
   const body = {
     job_id: currentJobId,
@@ -233,6 +236,14 @@ function handlePipelineEvent(evt) {
   }
 }
 
+function handleRenderProgress(evt) {
+  if (evt.job_id !== currentJobId || !evt.of) return;
+  const eta = evt.eta_sec != null ? ` · ${Math.ceil(evt.eta_sec)}s left` : '';
+  const speed = evt.speed ? ` · ${evt.speed}x` : '';
+  document.getElementById('pipeline-msg').textContent =
+    `Rendering clips (${evt.clips_done}/${evt.of} done) — ${evt.percent}%${speed}${eta}`;
+}
+
 /* ── Step 4: Library ──────────────────────────────────────────── */
 
 async function loadLibrary() {